@@ -0,0 +1,222 @@
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import os
+import re
+import stat
+
+from functools import partial
+
+import click
+
+from docker.errors import APIError
+
+from bag8.config import Config
+from bag8.context import iter_context
+from bag8.exceptions import NoDockerfile
+from bag8.project import Project
+from bag8.utils import Progress
+from bag8.utils import normalize_image
+from bag8.utils import parallel_dag
+from bag8.utils import write_atomic
+
+
+RE_FROM = re.compile(r'^\s*FROM\s+(\S+)', re.IGNORECASE | re.MULTILINE)
+
+
+def dockerfile_bases(path):
+    """Returns the images the Dockerfile at path starts FROM.
+    """
+    with open(path) as fd:
+        return [normalize_image(i) for i in RE_FROM.findall(fd.read())]
+
+
+def bare_id(image_id):
+    """Returns the image id without its digest algorithm, ex.: sha256:.
+    """
+    return image_id.split(':', 1)[-1]
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as fd:
+        for chunk in iter(partial(fd.read, 64 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class BuildManifest(object):
+    """Content hashes of a project build context and the id of the image last
+    built from it, kept in tmpfolder/build/<project>.json.
+    """
+
+    def __init__(self, project):
+        self.project = project
+        self.path = os.path.join(project.config.tmpfolder, 'build',
+                                 '{0}.json'.format(project.bag8_name))
+        self.files = {}
+        self.fingerprint = None
+        self.image_id = None
+        try:
+            with open(self.path) as fd:
+                data = json.load(fd)
+        except (IOError, ValueError):
+            return
+        self.files = data.get('files', {})
+        self.fingerprint = data.get('fingerprint')
+        self.image_id = data.get('image_id')
+
+    def dump(self):
+        write_atomic(self.path, json.dumps({
+            'files': self.files,
+            'fingerprint': self.fingerprint,
+            'image_id': self.image_id,
+        }))
+
+    def compute(self, bases=()):
+        """Returns the fingerprint of the build context and base images, files
+        are hashed again only when their mtime or size changed, ignored ones
+        are left out.
+        """
+        root = self.project.build_path
+        files = {}
+        key = hashlib.sha1(repr(list(bases)))
+        for rel_path in iter_context(root):
+            path = os.path.join(root, rel_path)
+            st = os.lstat(path)
+            cached = self.files.get(rel_path)
+            if cached and cached[:2] == [st.st_mtime, st.st_size]:
+                sha1 = cached[2]
+            elif stat.S_ISLNK(st.st_mode):
+                # may be dangling, the link itself goes to the context
+                sha1 = hashlib.sha1(os.readlink(path)).hexdigest()
+            elif stat.S_ISDIR(st.st_mode):
+                # content hashed on its own
+                sha1 = None
+            else:
+                sha1 = file_sha1(path)
+            files[rel_path] = [st.st_mtime, st.st_size, sha1]
+            key.update('{0}\0{1:o}\0{2}\0'.format(rel_path, st.st_mode, sha1))
+        self.files = files
+        return key.hexdigest()
+
+    def is_built(self, fingerprint, service):
+        """Tells if the service image is still the one built from the same
+        fingerprint.
+        """
+        if not self.image_id or fingerprint != self.fingerprint:
+            return False
+        try:
+            image = service.client.inspect_image(service.image_name)
+        except APIError:
+            return False
+        return bare_id(image['Id']).startswith(bare_id(self.image_id))
+
+
+class BuildPlan(object):
+    """Orders project builds after the builds of their bag8 base images.
+    """
+
+    def __init__(self, names=None, bases=True):
+        self._projects = {}
+        # image -> project building it, the index is only scanned for
+        # images not built by the planned projects
+        self._images = {}
+        self._scanned = False
+        if names is None:
+            self._scan()
+            names = sorted(set(self._images.values()))
+        for name in names:
+            if not self._add_image(name):
+                raise NoDockerfile('missing Dockerfile for: {0}'.format(name))
+        self.names = self._closure(names) if bases else list(names)
+
+    def project(self, name):
+        if name not in self._projects:
+            self._projects[name] = Project(name)
+        return self._projects[name]
+
+    def _has_dockerfile(self, project):
+        try:
+            return bool(project.build_path)
+        except NoDockerfile:
+            return False
+
+    def _add_image(self, name):
+        project = self.project(name)
+        if not self._has_dockerfile(project):
+            return False
+        if project.image:
+            self._images.setdefault(normalize_image(project.image), name)
+        return True
+
+    def _scan(self):
+        if not self._scanned:
+            for name in Config.get().project_index.names:
+                self._add_image(name)
+            self._scanned = True
+
+    def image_project(self, image):
+        """Returns the bag8 project building an image, None when not built by
+        bag8.
+        """
+        if image not in self._images:
+            self._scan()
+        return self._images.get(image)
+
+    def deps(self, name):
+        """Returns the bag8 projects building the base images of a project.
+        """
+        path = os.path.join(self.project(name).build_path, 'Dockerfile')
+        return [p for p in map(self.image_project, dockerfile_bases(path))
+                if p not in (None, name)]
+
+    def _closure(self, names):
+        names = list(names)
+        for name in names:
+            names.extend(d for d in self.deps(name) if d not in names)
+        return names
+
+    def base_ids(self, name):
+        """Returns the local ids of the project base images, their names when
+        not pulled yet.
+        """
+        path = os.path.join(self.project(name).build_path, 'Dockerfile')
+        client = self.project(name).client
+        ids = []
+        for base in dockerfile_bases(path):
+            try:
+                ids.append(client.inspect_image(base)['Id'])
+            except APIError:
+                ids.append(base)
+        return ids
+
+    def build(self, no_cache=False, parallel=1, force=False):
+        """Builds each project once, bases first, independent ones
+        concurrently. Skips the images already built from the same context
+        and base images unless forced.
+        """
+        progress = Progress() if parallel > 1 else None
+
+        def build(name):
+            project = self.project(name)
+            service = project.get_service(project.simple_name)
+            manifest = BuildManifest(project)
+            fingerprint = manifest.compute(self.base_ids(name))
+            if not force and not no_cache \
+                    and manifest.is_built(fingerprint, service):
+                # keeps the refreshed file hashes
+                manifest.dump()
+                if progress:
+                    progress.update(service.image_name, 'up to date')
+                else:
+                    click.echo('{0} is up to date'.format(service.image_name))
+                return manifest.image_id
+            image_id = service.build(no_cache=no_cache, progress=progress)
+            manifest.fingerprint = fingerprint
+            manifest.image_id = image_id
+            manifest.dump()
+            return image_id
+
+        return parallel_dag(build, self.names, self.deps, workers=parallel)
@@ -2,23 +2,14 @@ from __future__ import absolute_import, print_function
 
 import os.path
 import sys
-import yaml
 
 import click
 
-from docker.errors import APIError
-
+from bag8.exceptions import NoDockerfile
 from bag8.exceptions import NoProjectYaml
-from bag8.project import Project
-from bag8.tools import Tools
-from bag8.utils import check_call
-from bag8.utils import exec_
-from bag8.utils import inspect
-from bag8.utils import simple_name
-from bag8.yaml import Yaml
 
-from compose.service import BuildError
-from compose.cli.main import setup_logging
+# compose, docker and yaml are imported by the commands needing them, keeps
+# --help and shell completion fast
 
 
 def cwdname():
@@ -29,20 +20,67 @@ def isatty():
     return sys.stdout.isatty()
 
 
-@click.group()
+def duration(ctx, param, value):
+    from bag8.utils import parse_duration
+    if value is None:
+        return None
+    try:
+        return parse_duration(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+class ComposeCommand(click.Command):
+    """Sets compose logging up once the args are parsed, --help exits before.
+    """
+
+    def invoke(self, ctx):
+        from compose.cli.main import setup_logging
+        setup_logging()
+        return super(ComposeCommand, self).invoke(ctx)
+
+
+class Bag8Group(click.Group):
+
+    def command(self, *args, **kwargs):
+        kwargs.setdefault('cls', ComposeCommand)
+        return super(Bag8Group, self).command(*args, **kwargs)
+
+
+@click.group(cls=Bag8Group)
 def bag8():
-    setup_logging()
+    pass
 
 
 @bag8.command()
-@click.argument('project', default=cwdname)
+@click.argument('projects', nargs=-1)
+@click.option('--all', 'all_', default=False, is_flag=True,
+              help='Build all the projects having a Dockerfile, default: False.')  # noqa
+@click.option('--bases/--no-bases', default=True,
+              help='Build the bag8 projects used as base images first, default: True.')  # noqa
 @click.option('--cache/--no-cache', default=True,
               help="Use cache, default: True")
-def build(cache, project):
-    p = Project(project)
+@click.option('--force', default=False, is_flag=True,
+              help='Build even if the context did not change, default: False.')  # noqa
+@click.option('--parallel', default=1, type=int,
+              help='Number of concurrent builds, default: 1.')
+def build(all_, bases, cache, force, parallel, projects):
+    """Builds project images (default: current dir one), each base image once
+    and before the images built from it.
+    """
+    from compose.service import BuildError
+    from bag8.build import BuildPlan
     try:
-        p.build(no_cache=not cache)
-    except BuildError:
+        plan = BuildPlan(None if all_ else projects or [cwdname()],
+                         bases=bases)
+        plan.build(no_cache=not cache, parallel=parallel, force=force)
+    except NoDockerfile as e:
+        click.echo(e, err=True)
+        sys.exit(1)
+    except BuildError as e:
+        if parallel > 1:
+            click.echo('{0}: {1}'.format(e.service.image_name, e.reason),
+                       err=True)
         sys.exit(1)
 
 
@@ -57,6 +95,7 @@ def build(cache, project):
 def develop(command, interactive, prefix, project):
     """Drops you in develop environment of your project.
     """
+    from bag8.project import Project
     p = Project(project, develop=True, prefix=prefix)
 
     try:
@@ -78,9 +117,32 @@ def develop(command, interactive, prefix, project):
     p.execute(command=command, interactive=interactive)
 
 
+# completion runs on each tab press, compose is not needed there
+@bag8.command(cls=click.Command)
+@click.argument('kind', type=click.Choice(['projects', 'services']))
+@click.argument('project', default=cwdname)
+def complete(kind, project):
+    """Prints project or project service names, for shell completion.
+    """
+    from bag8.complete import project_names
+    from bag8.complete import service_names
+    # config and index messages would be taken as names
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        if kind == 'projects':
+            names = project_names()
+        else:
+            names = service_names(project)
+    finally:
+        sys.stdout = stdout
+    for name in names:
+        click.echo(name)
+
+
 @bag8.command()
 def dns():
     """Start or restart docker DNS server."""
+    from bag8.tools import Tools
     result = Tools().dns()
     if not result:
         return
@@ -102,6 +164,7 @@ def dns():
 def execute(command, prefix, project, service):
     """Exec command in a running container for a given project.
     """
+    from bag8.project import Project
     p = Project(project, prefix=prefix)
     p.execute(command=command, service_name=service)
 
@@ -117,6 +180,9 @@ def execute(command, prefix, project, service):
 def logs(follow, prefix, project, service):
     """Get logs for a project related container.
     """
+    from bag8.project import Project
+    from bag8.utils import exec_
+    from bag8.utils import simple_name
     p = Project(project, prefix=prefix)
     s = simple_name(service or project)
 
@@ -142,48 +208,72 @@ def logs(follow, prefix, project, service):
               help='Test mode ? no port binding.')
 @click.option('--upstream-server-domain', default=None,
               help='Specify nginx upstream server domain to render in config files.')  # noqa
-def nginx(local_projects, no_ports, upstream_server_domain):
+@click.option('--parallel', default=8, type=int,
+              help='Number of sites rendered concurrently, default: 8.')
+@click.option('--incremental', default=False, is_flag=True,
+              help='Reload running nginx with changed sites only, recreate it if links changed, default: False.')  # noqa
+@click.option('--watch', default=False, is_flag=True,
+              help='Keep nginx in sync with started and stopped projects, default: False.')  # noqa
+def nginx(incremental, local_projects, no_ports, parallel,
+          upstream_server_domain, watch):
     """Run nginx container linked with all available sites.
     """
-    # stop previous nginx if exist
-    try:
-        inspect('nginx')
-        check_call(['docker', 'rm', '-f', 'nginx'], exit=False)
-    except APIError:
-        pass
-    # start a new one
-    out, err, code = Tools().nginx(
+    from bag8.tools import Tools
+    if watch:
+        return Tools().watch_nginx(
+            local_projects=local_projects,
+            no_ports=no_ports,
+            parallel=parallel,
+            upstream_server_domain=upstream_server_domain,
+        )
+    Tools().nginx(
         local_projects=local_projects,
         no_ports=no_ports,
-        upstream_server_domain=upstream_server_domain
+        parallel=parallel,
+        upstream_server_domain=upstream_server_domain,
+        incremental=incremental,
     )
 
 
 @bag8.command()
 @click.argument('project', default=cwdname)
-def pull(project):
+@click.option('--parallel', default=1, type=int,
+              help='Number of concurrent pulls, default: 1.')
+def pull(parallel, project):
     """Pulls a project image (and all its dependencies).
     """
+    from bag8.project import Project
     p = Project(project)
-    p.pull()
+    p.pull(parallel=parallel)
 
 
 @bag8.command()
-@click.argument('project', default=cwdname)
-def push(project):
-    """Push the image of the given project,
+@click.argument('projects', nargs=-1)
+@click.option('--force', default=False, is_flag=True,
+              help='Push even if pushed since the last build, default: False.')  # noqa
+@click.option('--parallel', default=1, type=int,
+              help='Number of concurrent pushes, default: 1.')
+def push(force, parallel, projects):
+    """Push the images of the given projects (default: current dir one),
+    skips the ones unchanged since their last push.
     """
-    p = Project(project)
-    p.push(service_names=[p.simple_name], insecure_registry=True)
+    from bag8.push import push_projects
+    push_projects(projects or [cwdname()], insecure_registry=True,
+                  parallel=parallel, force=force)
 
 
 @bag8.command()
 @click.argument('project', default=cwdname)
 @click.argument('output', type=click.File('wb'), default='fig.yml')
-def render(output, project):
+@click.option('--cache/--no-cache', default=True,
+              help="Use rendered cache, default: True")
+def render(cache, output, project):
     """Renders fig.yml like content to out file, default: fig.yml.
     """
-    yaml.safe_dump(Yaml(Project(project)).data, output, indent=2,
+    import yaml
+    from bag8.project import Project
+    from bag8.yaml import Yaml
+    yaml.safe_dump(Yaml(Project(project), cache=cache).data, output, indent=2,
                    encoding='utf-8', allow_unicode=True)
 
 
@@ -193,21 +283,47 @@ def render(output, project):
               help='Project prefix. default: project.name.')
 @click.option('-s', '--service', default=None,
               help='Service container we want exec, default: project.name.')
-def rm(prefix, project, service):
+@click.option('--with-deps', default=False, is_flag=True,
+              help='With --service, also remove the services it depends on, default: False.')  # noqa
+@click.option('--parallel', default=4, type=int,
+              help='Number of containers removed concurrently, default: 4.')
+def rm(parallel, prefix, project, service, with_deps):
     """Removes containers for a given project.
     """
+    from bag8.project import Project
     p = Project(project, prefix=prefix)
     service_names = None if not service else [service]
-    p.stop(service_names=service_names, timeout=0)
-    p.remove_stopped(service_names=service_names)
+    p.stop(service_names=service_names, include_deps=with_deps,
+           parallel=parallel, timeout=0)
+    p.remove_stopped(service_names=service_names, include_deps=with_deps,
+                     parallel=parallel)
 
 
 @bag8.command()
-@click.argument('project', default=cwdname)
-def rmi(project):
-    """Removes an image locally.
+@click.argument('projects', nargs=-1)
+@click.option('--dangling', default=False, is_flag=True,
+              help='Remove the untagged images built by bag8, default: False.')  # noqa
+@click.option('--older-than', default=None, callback=duration,
+              help='Remove the images built by bag8 before, ex.: 12h, 7d.')
+@click.option('--parallel', default=4, type=int,
+              help='Number of concurrent removals, default: 4.')
+def rmi(dangling, older_than, parallel, projects):
+    """Removes project images locally (default: current dir one), or prunes
+    the images built by bag8.
     """
-    Project(project).rmi()
+    from bag8.client import get_client
+    from bag8.images import prune_images
+    from bag8.project import Project
+    failed = []
+    if dangling or older_than is not None:
+        failed += prune_images(get_client(), dangling=dangling,
+                               older_than=older_than, parallel=parallel)[1]
+    elif not projects:
+        projects = [cwdname()]
+    for project in projects:
+        failed += Project(project).rmi(parallel=parallel)[1]
+    if failed:
+        sys.exit(1)
 
 
 @bag8.command()
@@ -220,11 +336,14 @@ def rmi(project):
               help='Do not --rm after, default: False')
 @click.option('-p', '--prefix', default=None,
               help='Project prefix. default: project.name.')
-def run(command, develop, keep, prefix, project):
+@click.option('--parallel', default=1, type=int,
+              help='Number of deps started concurrently, default: 1.')
+def run(command, develop, keep, parallel, prefix, project):
     """Start containers for a given project.
     """
+    from bag8.project import Project
     p = Project(project, develop=develop, prefix=prefix)
-    p.run(command=command, remove=not keep)
+    p.run(command=command, remove=not keep, parallel=parallel)
 
 
 @bag8.command()
@@ -238,6 +357,7 @@ def run(command, develop, keep, prefix, project):
 def start(interactive, prefix, project, service):
     """Start containers for a given project.
     """
+    from bag8.project import Project
     p = Project(project, prefix=prefix)
     service_names = None if not service else [service]
     p.start(interactive=interactive, service_names=service_names)
@@ -249,12 +369,18 @@ def start(interactive, prefix, project, service):
               help='Project prefix. default: project.name.')
 @click.option('-s', '--service', default=None,
               help='Service container we want stop, default: None.')
-def stop(project, prefix, service):
+@click.option('--with-deps', default=False, is_flag=True,
+              help='With --service, also stop the services it depends on, default: False.')  # noqa
+@click.option('--parallel', default=4, type=int,
+              help='Number of containers stopped concurrently, default: 4.')
+def stop(parallel, project, prefix, service, with_deps):
     """Stop containers for a given project.
     """
+    from bag8.project import Project
     p = Project(project, prefix=prefix)
     service_names = None if not service else [service]
-    p.stop(service_names=service_names, timeout=0)
+    p.stop(service_names=service_names, include_deps=with_deps,
+           parallel=parallel, timeout=0)
 
 
 @bag8.command()
@@ -263,12 +389,16 @@ def stop(project, prefix, service):
               help='Start the containers in develop mode. default: False.')
 @click.option('-p', '--prefix', default=None,
               help='Project prefix. default: project.name.')
-def up(develop, prefix, project):
+@click.option('--parallel', default=1, type=int,
+              help='Number of services started concurrently, default: 1.')
+def up(develop, parallel, prefix, project):
     """Up containers for a given project
     """
+    from compose.service import BuildError
+    from bag8.project import Project
     p = Project(project, develop=develop, prefix=prefix)
     try:
-        p.up(allow_recreate=False)
+        p.up(allow_recreate=False, parallel=parallel)
     except BuildError as e:
         click.echo(e.reason, err=True)
         sys.exit(1)
@@ -0,0 +1,80 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import threading
+
+import requests.adapters
+
+from compose.cli.docker_client import docker_client
+
+from docker.unixconn.unixconn import UnixAdapter
+from docker.unixconn.unixconn import UnixHTTPConnectionPool
+from docker.unixconn.unixconn import urllib3
+
+from bag8.config import Config
+
+
+# process wide docker clients, keyed by docker host
+_clients = {}
+_lock = threading.Lock()
+
+
+class PooledUnixHTTPConnectionPool(UnixHTTPConnectionPool):
+    """docker-py unix pool keeps one connection only, we need more for
+    concurrent calls.
+    """
+
+    def __init__(self, base_url, socket_path, timeout=60, maxsize=1):
+        urllib3.connectionpool.HTTPConnectionPool.__init__(
+            self, 'localhost', timeout=timeout, maxsize=maxsize
+        )
+        self.base_url = base_url
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+
+class PooledUnixAdapter(UnixAdapter):
+
+    def __init__(self, socket_url, timeout=60, maxsize=1):
+        super(PooledUnixAdapter, self).__init__(socket_url, timeout=timeout)
+        self.maxsize = maxsize
+
+    def get_connection(self, url, proxies=None):
+        with self.pools.lock:
+            pool = self.pools.get(url)
+            if pool:
+                return pool
+
+            pool = PooledUnixHTTPConnectionPool(url,
+                                                self.socket_path,
+                                                self.timeout,
+                                                maxsize=self.maxsize)
+            self.pools[url] = pool
+
+        return pool
+
+
+def get_client():
+    """Returns the docker client shared by all the projects and services,
+    keep-alive connections pool size comes from the config.
+    """
+    key = os.environ.get('DOCKER_HOST')
+    with _lock:
+        if key not in _clients:
+            _clients[key] = _pooled(docker_client(),
+                                    Config.get().docker_pool_size)
+        return _clients[key]
+
+
+def _pooled(client, maxsize):
+    adapter = getattr(client, '_custom_adapter', None)
+    if isinstance(adapter, UnixAdapter):
+        client._custom_adapter = PooledUnixAdapter(
+            'http+unix://' + adapter.socket_path, adapter.timeout,
+            maxsize=maxsize)
+        client.mount('http+docker://', client._custom_adapter)
+    elif client.base_url.startswith('http://'):
+        client.mount('http://', requests.adapters.HTTPAdapter(
+            pool_maxsize=maxsize))
+    # tls adapters are left as configured by docker-py
+    return client
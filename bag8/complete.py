@@ -0,0 +1,52 @@
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+
+from bag8.index import ProjectIndex
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def project_names():
+    """Returns the project names from the cached index, refreshed when the
+    data paths mtimes change. The config is loaded only when the index is
+    missing or older than the config.
+    """
+    # same paths as Config, without loading it
+    config_path = os.path.expanduser('~/.config/bag8.yml')
+    cache_path = os.path.expanduser('~/.local/bag8/projects.json')
+    try:
+        with open(cache_path) as fd:
+            data_paths = json.load(fd)['data_paths']
+    except (IOError, KeyError, TypeError, ValueError):
+        data_paths = None
+    if data_paths is None or _mtime(config_path) > _mtime(cache_path):
+        from bag8.config import Config
+        return Config.get().project_index.names
+    return ProjectIndex.get(data_paths, cache_path=cache_path).names
+
+
+def service_names(project):
+    """Returns the service names of the last project renders, empty until the
+    project is rendered once.
+    """
+    from bag8.utils import yaml_load
+    names = set()
+    for suffix in ('', '.develop'):
+        path = os.path.expanduser('~/.local/bag8/render/{0}{1}.yml'.format(
+            project, suffix))
+        if not os.path.exists(path):
+            continue
+        with open(path) as fd:
+            cached = yaml_load(fd)
+        try:
+            names.update(cached['data'])
+        except (KeyError, TypeError):
+            continue
+    return sorted(names)
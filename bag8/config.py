@@ -2,7 +2,21 @@ from __future__ import absolute_import, division, print_function
 
 import click
 import os
-import yaml
+
+from bag8.index import ProjectIndex
+from bag8.utils import yaml_load
+
+
+# process wide configs, keyed by config path
+_configs = {}
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
 
 
 class Config(object):
@@ -12,8 +26,10 @@ class Config(object):
         self.tmpfolder = os.path.expanduser('~/.local/bag8/')
         # load config
         self.config_path = os.path.expanduser('~/.config/bag8.yml')
-        if os.path.exists(self.config_path):
-            data = yaml.load(open(self.config_path))
+        self.stat = _stat(self.config_path)
+        if self.stat:
+            with open(self.config_path) as fd:
+                data = yaml_load(fd) or {}
         else:
             click.echo('No config found at: {0}.'.format(self.config_path))
             click.echo('Loads default values.')
@@ -33,6 +49,18 @@ class Config(object):
         self.nameserver = data.get('nameserver', '8.8.8.8:53')
         self.wait_seconds = data.get('wait_seconds', 10)
         self.skip_wait = data.get('skip_wait', False)
+        self.cache_project_index = data.get('cache_project_index', True)
+        self.docker_pool_size = data.get('docker_pool_size', 10)
+
+    @classmethod
+    def get(cls):
+        """Returns the shared config, reloaded when the file changes.
+        """
+        config_path = os.path.expanduser('~/.config/bag8.yml')
+        config = _configs.get(config_path)
+        if config is None or config.stat != _stat(config_path):
+            config = _configs[config_path] = cls()
+        return config
 
     def iter_data_paths(self):
         for p in self._data_paths:
@@ -44,6 +72,22 @@ class Config(object):
                     continue
                 yield p, d
 
+    @property
+    def project_index(self):
+        cache_path = None
+        if self.cache_project_index:
+            cache_path = os.path.join(self.tmpfolder, 'projects.json')
+        return ProjectIndex.get(self._data_paths, cache_path=cache_path)
+
+    def get_project_path(self, name):
+        return self.project_index.get_path(name)
+
+    @property
+    def search_paths(self):
+        """Returns the configured data paths, existing or not.
+        """
+        return list(self._data_paths)
+
     @property
     def data_paths(self):
         return [p for p, d in self.iter_data_paths()]
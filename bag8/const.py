@@ -1,2 +1,4 @@
 LABEL_BAG8_PROJECT = 'com.docker.compose.bag8-project'
 LABEL_BAG8_SERVICE = 'com.docker.compose.bag8-service'
+LABEL_BAG8_NGINX = 'com.docker.compose.bag8-nginx'
+LABEL_BAG8_IMAGE = 'com.docker.compose.bag8-image'
@@ -0,0 +1,99 @@
+from __future__ import absolute_import, division, print_function
+
+import io
+import json
+import os
+import tarfile
+import tempfile
+
+from fnmatch import fnmatch
+
+
+# patterns of files left out of the build context, one per line
+IGNORE_FILES = ['.dockerignore', '.bag8ignore']
+
+
+def ignore_patterns(root):
+    """Returns the patterns of the build path ignore files.
+    """
+    patterns = []
+    for name in IGNORE_FILES:
+        path = os.path.join(root, name)
+        if not os.path.exists(path):
+            continue
+        with open(path) as fd:
+            for line in fd:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    patterns.append(os.path.normpath(line.rstrip('/')))
+    return patterns
+
+
+def is_ignored(rel_path, patterns):
+    # the daemon needs the Dockerfile
+    if rel_path == 'Dockerfile':
+        return False
+    return any(fnmatch(rel_path, p) for p in patterns)
+
+
+def iter_context(root):
+    """Yields the relative paths of the build context files and dirs in a
+    stable order, dirs before their content. Ignored dirs are not walked,
+    symlinked ones are yielded as links.
+    """
+    patterns = ignore_patterns(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root)
+        if rel_dir != '.':
+            yield rel_dir
+        rel_paths = dict((n, os.path.normpath(os.path.join(rel_dir, n)))
+                         for n in dirnames + filenames)
+        dirnames[:] = sorted(d for d in dirnames
+                             if not is_ignored(rel_paths[d], patterns))
+        # os.walk lists symlinked dirs but does not follow them
+        links = [d for d in dirnames if os.path.islink(os.path.join(dirpath,
+                                                                    d))]
+        dirnames[:] = [d for d in dirnames if d not in links]
+        for name in sorted(filenames + links):
+            if not is_ignored(rel_paths[name], patterns):
+                yield rel_paths[name]
+
+
+def build_context(root, labels=None):
+    """Writes the build context tar to a temporary file, returns it ready to
+    be streamed with its size. Labels are added to the image with a LABEL
+    instruction at the end of the Dockerfile.
+    """
+    context = tempfile.TemporaryFile()
+    tar = tarfile.open(mode='w', fileobj=context)
+    try:
+        for rel_path in iter_context(root):
+            path = os.path.join(root, rel_path)
+            if rel_path != 'Dockerfile' or not labels:
+                tar.add(path, arcname=rel_path, recursive=False)
+                continue
+            with open(path, 'rb') as fd:
+                content = fd.read()
+            # keep the last line as is, the LABEL one must not join it
+            if not content.endswith(b'\n'):
+                content += b'\n'
+            content += '\nLABEL {0}\n'.format(' '.join(
+                '{0}={1}'.format(json.dumps(k), json.dumps(v))
+                for k, v in sorted(labels.items()))).encode('utf-8')
+            info = tar.gettarinfo(path, arcname=rel_path)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    finally:
+        tar.close()
+    size = context.tell()
+    context.seek(0)
+    return context, size
+
+
+def format_size(size):
+    if size < 1024:
+        return '{0} B'.format(size)
+    for unit in ['KB', 'MB', 'GB']:
+        size /= 1024
+        if size < 1024 or unit == 'GB':
+            return '{0:.1f} {1}'.format(size, unit)
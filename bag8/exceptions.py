@@ -13,3 +13,7 @@ class CheckCallFailed(Exception):
 
 class WaitLinkFailed(Exception):
     pass
+
+
+class CyclicDependency(Exception):
+    pass
@@ -0,0 +1,48 @@
+from __future__ import absolute_import, division, print_function
+
+from bag8.exceptions import CyclicDependency
+
+
+class DependencyGraph(object):
+    """Resolves projects links once per project, deps first.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._projects = {}
+        self._deps = {}
+
+    def add(self, project):
+        self._projects.setdefault(project.bag8_name, project)
+
+    def project(self, name):
+        if name not in self._projects:
+            self._projects[name] = self.factory(name, graph=self)
+        return self._projects[name]
+
+    def links(self, name):
+        project = self.project(name)
+        internal_links = project.internal_links
+        return [l for l in project.links if l not in internal_links]
+
+    def deps_names(self, name, _path=None):
+        """Returns all the deps of a project in a stable topological order.
+        """
+        if name in self._deps:
+            return self._deps[name]
+
+        path = (_path or []) + [name]
+
+        deps = []
+        seen = set()
+        for link in self.links(name):
+            if link in path:
+                raise CyclicDependency(' -> '.join(path + [link]))
+            for n in self.deps_names(link, _path=path) + [link]:
+                if n in seen:
+                    continue
+                seen.add(n)
+                deps.append(n)
+
+        self._deps[name] = deps
+        return deps
@@ -0,0 +1,128 @@
+from __future__ import absolute_import, division, print_function
+
+import random
+import re
+
+from time import sleep
+from time import time
+
+import click
+import requests
+
+from docker.errors import APIError
+
+from bag8.exceptions import WaitLinkFailed
+
+
+class HealthCheck(object):
+    """Tells if a linked service is ready, configured in its fig.yml section:
+
+        healthcheck:
+          http: 8080/health  # or command: ... or log: ...
+
+    Subclasses define check(), True once the service is ready.
+    """
+
+    def __init__(self, service, host, value):
+        self.service = service
+        self.host = host
+        self.value = value
+
+    def __str__(self):
+        return '{0} {1}'.format(self.host, self.value)
+
+    @property
+    def container(self):
+        for c in self.service.containers():
+            return c
+
+
+class HttpCheck(HealthCheck):
+    """GET on the given port and path, ex.: `8080/health`, default port is the
+    first exposed one. Ready on 2xx and 3xx responses.
+    """
+
+    @property
+    def url(self):
+        port, _, path = str(self.value).partition('/')
+        if not port:
+            port = str((self.service.options.get('expose') or [80])[0])
+        return 'http://{0}:{1}/{2}'.format(self.host, port.split(':')[0],
+                                           path)
+
+    def check(self):
+        try:
+            response = requests.get(self.url, timeout=1,
+                                    allow_redirects=False)
+        except requests.RequestException:
+            return False
+        return response.status_code < 400
+
+
+class CommandCheck(HealthCheck):
+    """Runs the command in the service container, ready on exit code 0.
+    """
+
+    def check(self):
+        container = self.container
+        if not container:
+            return False
+        client = self.service.client
+        try:
+            exec_id = client.exec_create(container.id, self.value)
+            client.exec_start(exec_id)
+            return client.exec_inspect(exec_id)['ExitCode'] == 0
+        except APIError:
+            # container stopped or removed meanwhile
+            return False
+
+
+class LogCheck(HealthCheck):
+    """Searches the service container logs, ready once the pattern matches.
+    """
+
+    def check(self):
+        container = self.container
+        if not container:
+            return False
+        try:
+            logs = self.service.client.logs(container.id)
+        except APIError:
+            return False
+        return re.search(self.value, logs, re.MULTILINE) is not None
+
+
+CHECKS = {
+    'command': CommandCheck,
+    'http': HttpCheck,
+    'log': LogCheck,
+}
+
+
+def get_health_check(service, host):
+    """Returns the service health check or None, TCP connect is used then.
+    """
+    healthcheck = service.healthcheck
+    if not healthcheck:
+        return None
+    if len(healthcheck) != 1 or list(healthcheck)[0] not in CHECKS:
+        raise ValueError('healthcheck of {0} expects one of: {1}'.format(
+            service.name, ', '.join(sorted(CHECKS))))
+    kind, value = list(healthcheck.items())[0]
+    return CHECKS[kind](service, host, value)
+
+
+def wait_health_check(check, max_wait=10, backoff=0.1, max_backoff=2):
+    """Retries the check with a jittered exponential backoff until max_wait
+    seconds.
+    """
+    deadline = time() + max_wait
+    attempts = 0
+    while not check.check():
+        if time() > deadline:
+            raise WaitLinkFailed("{0} not ready".format(check))
+        click.echo('wait for {0}'.format(check))
+        delay = min(max_backoff, backoff * 2 ** attempts)
+        sleep(min(delay * random.uniform(0.5, 1.5),
+                  max(0, deadline - time())))
+        attempts += 1
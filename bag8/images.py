@@ -0,0 +1,94 @@
+from __future__ import absolute_import, division, print_function
+
+from time import time
+
+from docker.errors import APIError
+
+from bag8.const import LABEL_BAG8_IMAGE
+from bag8.utils import Progress
+from bag8.utils import normalize_image
+from bag8.utils import parallel_map
+
+
+# tags of images without repository
+NONE_TAG = '<none>:<none>'
+
+
+class ImageInventory(object):
+    """Local images, listed once, indexed by repo:tag.
+    """
+
+    def __init__(self, client, filters=None):
+        self.images = client.images(filters=filters)
+        self.tags = {}
+        for image in self.images:
+            for tag in image.get('RepoTags') or []:
+                if tag != NONE_TAG:
+                    self.tags[tag] = image
+
+    def get(self, name):
+        return self.tags.get(normalize_image(name))
+
+
+def remove_images(client, names, force=False, parallel=1):
+    """Removes the images concurrently, returns the removed and the failed
+    ones. Failures, ex.: images used by containers, are reported and skipped.
+    """
+    progress = Progress()
+
+    def remove(name):
+        try:
+            client.remove_image(name, force=force)
+        except APIError as e:
+            progress.update(name, 'not removed, {0}'.format(
+                getattr(e, 'explanation', None) or e))
+            return False
+        progress.update(name, 'removed')
+        return True
+
+    names = list(names)
+    results = zip(names, parallel_map(remove, names, workers=parallel))
+    return ([n for n, removed in results if removed],
+            [n for n, removed in results if not removed])
+
+
+def _project_repo(name):
+    from bag8.config import Config
+    from bag8.project import Project  # imports this module
+    if not Config.get().get_project_path(name):
+        return None
+    image = Project(name).image
+    return image and normalize_image(image).rsplit(':', 1)[0]
+
+
+def prune_images(client, dangling=False, older_than=None, force=False,
+                 parallel=1):
+    """Removes the images built by bag8, only the dangling ones and or the
+    ones created more than older_than seconds ago, returns the removed and
+    the failed ones. Images built FROM a bag8 one inherit its label, only the
+    tags in the repo of the labelled project are removed, untagged ones only
+    when the project still exists.
+    """
+    filters = {'label': LABEL_BAG8_IMAGE}
+    if dangling:
+        filters['dangling'] = True
+    inventory = ImageInventory(client, filters=filters)
+
+    repos = {}
+    names = []
+    for image in inventory.images:
+        if older_than is not None and image['Created'] > time() - older_than:
+            continue
+        project = (image.get('Labels') or {}).get(LABEL_BAG8_IMAGE)
+        if project not in repos:
+            repos[project] = project and _project_repo(project)
+        if not repos[project]:
+            continue
+        tags = [t for t in image.get('RepoTags') or [] if t != NONE_TAG]
+        if not tags:
+            names.append(image['Id'])
+            continue
+        # tagged images are removed per tag, a shared image id would conflict
+        names.extend(sorted(t for t in tags
+                            if t.rsplit(':', 1)[0] == repos[project]))
+    return remove_images(client, names, force=force, parallel=parallel)
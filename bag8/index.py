@@ -0,0 +1,109 @@
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import threading
+
+import click
+
+
+# process wide indexes, keyed by data paths
+_indexes = {}
+
+
+def _mtimes(data_paths):
+    mtimes = {}
+    for p in data_paths:
+        try:
+            mtimes[os.path.abspath(p)] = os.stat(p).st_mtime
+        except OSError:
+            mtimes[os.path.abspath(p)] = None
+    return mtimes
+
+
+class ProjectIndex(object):
+    """Maps bag8 project names to their dir, first data path wins.
+    """
+
+    def __init__(self, data_paths, cache_path=None):
+        self.data_paths = list(data_paths)
+        self.cache_path = cache_path
+        self._mtimes = None
+        self._projects = {}
+        self._scanned = False
+        # render threads resolve project paths at the same time
+        self._lock = threading.RLock()
+
+    @classmethod
+    def get(cls, data_paths, cache_path=None):
+        key = tuple(data_paths)
+        if key not in _indexes:
+            _indexes.setdefault(key, cls(data_paths, cache_path=cache_path))
+        return _indexes[key]
+
+    def _scan(self):
+        projects = {}
+        for p in self.data_paths:
+            if not os.path.exists(p):
+                click.echo('skip path: {0}'.format(p))
+                continue
+            for d in os.listdir(p):
+                if d in projects:
+                    continue
+                if not os.path.exists(os.path.join(p, d, 'fig.yml')):
+                    continue
+                projects[d] = os.path.join(p, d)
+        return projects
+
+    def _load(self, mtimes):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path) as fd:
+                data = json.load(fd)
+        except ValueError:
+            return None
+        if data.get('data_paths') != self.data_paths \
+                or data.get('mtimes') != mtimes:
+            return None
+        return dict((str(k), str(v)) for k, v in data['projects'].items())
+
+    def _dump(self):
+        # yaml and friends are not needed to read the index, see complete
+        from bag8.utils import write_atomic
+        if not self.cache_path:
+            return
+        write_atomic(self.cache_path, json.dumps({
+            'data_paths': self.data_paths,
+            'mtimes': self._mtimes,
+            'projects': self._projects,
+        }))
+
+    def refresh(self, force=False):
+        with self._lock:
+            mtimes = _mtimes(self.data_paths)
+            if not force and mtimes == self._mtimes:
+                return
+            projects = None if force else self._load(mtimes)
+            self._scanned = projects is None
+            if projects is None:
+                projects = self._scan()
+            self._mtimes = mtimes
+            self._projects = projects
+            if self._scanned:
+                self._dump()
+
+    def get_path(self, name):
+        """Returns the project dir or None, rescans once when the index comes
+        from the cache file, a fig.yml may be added without dir mtime change.
+        """
+        with self._lock:
+            self.refresh()
+            if name not in self._projects and not self._scanned:
+                self.refresh(force=True)
+            return self._projects.get(name)
+
+    @property
+    def names(self):
+        self.refresh()
+        return sorted(self._projects)
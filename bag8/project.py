@@ -1,42 +1,54 @@
 from __future__ import absolute_import, division, print_function
 
 import os
-import yaml
 
 import click
 
-from compose.cli.docker_client import docker_client
+from compose.const import DEFAULT_TIMEOUT
 from compose.const import LABEL_PROJECT
 from compose.project import Project as ComposeProject
 from compose.project import sort_service_dicts
 from compose.project import NoSuchService
 
+from bag8.client import get_client
 from bag8.config import Config
 from bag8.const import LABEL_BAG8_SERVICE
 from bag8.const import LABEL_BAG8_PROJECT
 from bag8.exceptions import NoDockerfile
 from bag8.exceptions import NoProjectYaml
+from bag8.graph import DependencyGraph
+from bag8.images import ImageInventory
+from bag8.images import remove_images
+from bag8.service import ContainerSnapshot
 from bag8.service import Service
+from bag8.utils import Progress
+from bag8.utils import load_yaml_file
+from bag8.utils import parallel_dag
+from bag8.utils import parallel_map
 from bag8.utils import simple_name
 from bag8.yaml import Yaml
 
 
 class Project(ComposeProject):
 
-    def __init__(self, name, develop=False, prefix=None):
+    def __init__(self, name, develop=False, prefix=None, graph=None):
 
         self.name = simple_name(prefix or name)
 
         self.prefix = prefix
         self.bag8_name = name
 
-        self.config = Config()
+        self.config = Config.get()
         self.develop = develop
 
+        self._graph = graph
         self._services = []
         self._yaml = None
 
-        super(Project, self).__init__(self.name, [], docker_client())
+        super(Project, self).__init__(self.name, [], get_client())
+
+        # containers listed once per command
+        self.snapshot = ContainerSnapshot(self.client, self.name)
 
     def labels(self, one_off=False):
         return super(Project, self).labels(one_off=one_off) + [
@@ -49,9 +61,9 @@ class Project(ComposeProject):
 
     @property
     def bag8_path(self):
-        for path, _project in self.config.iter_data_paths():
-            if _project == self.bag8_name:
-                return os.path.join(path, _project)
+        path = self.config.get_project_path(self.bag8_name)
+        if path:
+            return path
         raise NoProjectYaml('missing dir for: {0}'.format(self.bag8_name))
 
     @property
@@ -84,7 +96,7 @@ class Project(ComposeProject):
     @property
     def yaml(self):
         if not self._yaml:
-            self._yaml = yaml.load(open(self.yaml_path))
+            self._yaml = load_yaml_file(self.yaml_path)
         return self._yaml
 
     @property
@@ -116,34 +128,32 @@ class Project(ComposeProject):
 
     @classmethod
     def iter_projects(cls):
-        __yielded = []
-        for c in docker_client().containers():
+        """Yields a descriptor per running bag8 project and prefix.
+        """
+        yielded = set()
+        for c in get_client().containers(filters={
+                'label': LABEL_BAG8_SERVICE}):
             name = c['Labels'].get(LABEL_BAG8_SERVICE)
             prefix = c['Labels'].get(LABEL_PROJECT)
             # not a compose project
             if not name:
                 continue
-            key = '{0}:{1}'.format(prefix, name)
-            if key in __yielded:
+            key = (prefix, name)
+            if key in yielded:
                 continue
-            __yielded.append(key)
-            yield Project(name, prefix=prefix)
-
-    def iter_deps_names(self, _wrap=True):
+            yielded.add(key)
+            yield ProjectRef(name, prefix=prefix)
 
-        if _wrap:
-            # uniqify deps
-            for p in set([p for p in self.iter_deps_names(_wrap=False)]):
-                yield p
-            raise StopIteration()
+    @property
+    def graph(self):
+        if self._graph is None:
+            self._graph = DependencyGraph(Project)
+            self._graph.add(self)
+        return self._graph
 
-        for link in self.links:
-            if link in self.internal_links:
-                continue
-            link_project = Project(link)
-            for sub_link in link_project.iter_deps_names(_wrap=False):
-                yield sub_link
-            yield link
+    def iter_deps_names(self):
+        for name in self.graph.deps_names(self.bag8_name):
+            yield name
 
     @property
     def deps_names(self):
@@ -151,7 +161,7 @@ class Project(ComposeProject):
 
     @property
     def deps(self):
-        return [Project(n) for n in self.deps_names]
+        return [self.graph.project(n) for n in self.deps_names]
 
     def get_container_name(self, service_name=None, stopped=False):
         service_name = service_name or self.simple_name
@@ -165,7 +175,7 @@ class Project(ComposeProject):
 
     @classmethod
     def from_dicts(cls, name, service_dicts, client, bag8_name='',
-                   prefix=None):
+                   prefix=None, snapshot=None):
         """Overrides compose method to use custom service class
         """
         project = cls(name, prefix=prefix)
@@ -179,6 +189,7 @@ class Project(ComposeProject):
                                              links=links,
                                              net=net,
                                              volumes_from=volumes_from,
+                                             snapshot=snapshot,
                                              **service_dict))
         return project
 
@@ -186,11 +197,13 @@ class Project(ComposeProject):
     def services(self):
         if not self._services:
             _yaml = Yaml(self)
-            self._services = Project.from_dicts(self.name,
-                                                _yaml.service_dicts,
-                                                self.client,
-                                                bag8_name=self.bag8_name,
-                                                prefix=self.prefix).services
+            project = Project.from_dicts(self.name,
+                                         _yaml.service_dicts,
+                                         self.client,
+                                         bag8_name=self.bag8_name,
+                                         prefix=self.prefix,
+                                         snapshot=self.snapshot)
+            self._services = project.services
         return self._services
 
     @services.setter
@@ -199,25 +212,97 @@ class Project(ComposeProject):
         """
         pass
 
-    def pull(self, service_names=None, insecure_registry=None):
+    def pull(self, service_names=None, insecure_registry=None, parallel=1):
 
         if insecure_registry is None:
             insecure_registry = self.config.insecure_registry
         else:
             insecure_registry = False
 
+        # one pull per image
+        services = []
+        images = set()
         for service in self.get_services(service_names, include_deps=True):
-            service.pull(insecure_registry=insecure_registry)
+            image = service.options.get('image')
+            if image in images:
+                continue
+            images.add(image)
+            services.append(service)
+
+        if parallel <= 1:
+            for service in services:
+                service.pull(insecure_registry=insecure_registry)
+            return
+
+        progress = Progress()
+        parallel_map(lambda s: s.pull(insecure_registry=insecure_registry,
+                                      progress=progress),
+                     services, workers=parallel)
 
     def push(self, service_names=None, insecure_registry=False):
         for service in self.get_services(service_names):
             service.push(insecure_registry=insecure_registry)
 
-    def rmi(self, service_names=None, force=False):
+    def rmi(self, service_names=None, force=False, parallel=1):
+        """Removes the services images found in one images listing, returns
+        the removed and the failed ones.
+        """
+        inventory = ImageInventory(self.client)
+        names = []
         for service in self.get_services(service_names):
-            service.rmi(force=force)
+            if service.image_name in names:
+                continue
+            if not inventory.get(service.image_name):
+                click.echo('image not found: {0}'.format(service.image_name))
+                continue
+            names.append(service.image_name)
+        return remove_images(self.client, names, force=force,
+                             parallel=parallel)
+
+    def up(self, service_names=None, start_deps=True, allow_recreate=True,
+           smart_recreate=False, insecure_registry=False, do_build=True,
+           timeout=DEFAULT_TIMEOUT, parallel=1):
+        """Overrides compose method to refresh the containers snapshot and to
+        start independent services at the same time, each one as soon as its
+        own deps are up.
+        """
+        services = self.get_services(service_names, include_deps=start_deps)
+
+        for service in services:
+            service.remove_duplicate_containers()
+        self.snapshot.refresh()
+
+        plans = self._get_convergence_plans(
+            services,
+            allow_recreate=allow_recreate,
+            smart_recreate=smart_recreate,
+        )
+
+        def converge(name):
+            return self.get_service(name).execute_convergence_plan(
+                plans[name],
+                insecure_registry=insecure_registry,
+                do_build=do_build,
+                timeout=timeout,
+            )
 
-    def run(self, **options):
+        try:
+            if parallel <= 1:
+                containers = dict((s.name, converge(s.name))
+                                  for s in services)
+            else:
+                containers = parallel_dag(
+                    converge,
+                    [s.name for s in services],
+                    lambda name: self.get_service(name).get_dependency_names(),
+                    workers=parallel,
+                )
+        finally:
+            self.snapshot.refresh()
+
+        return [c for s in services for c in containers[s.name]]
+
+    def run(self, parallel=1, **options):
         service = self.get_service(self.simple_name)
         deps = service.get_linked_names()
         if len(deps) > 0:
@@ -226,16 +311,117 @@ class Project(ComposeProject):
                 start_deps=True,
                 allow_recreate=options.get('allow_recreate', False),
                 insecure_registry=options.get('insecure_registry'),
+                parallel=parallel,
             )
         service.run(**options)
 
     def start(self, service_names=None, interactive=False, **options):
-        for service in self.get_services(service_names):
-            kwargs = options.copy()
-            if service.name == self.simple_name:
-                kwargs['interactive'] = interactive
-            service.start(**kwargs)
+        try:
+            for service in self.get_services(service_names):
+                kwargs = options.copy()
+                if service.name == self.simple_name:
+                    kwargs['interactive'] = interactive
+                service.start(**kwargs)
+        finally:
+            self.snapshot.refresh()
+
+    def _each_container(self, func, service_names=None, include_deps=False,
+                        stopped=False, parallel=1):
+        """Calls func on the services containers concurrently, reports the
+        status it returns per container.
+        """
+        progress = Progress()
+        containers = [
+            c for service in self.get_services(service_names,
+                                               include_deps=include_deps)
+            for c in service.containers(stopped=stopped)
+        ]
+
+        def run(container):
+            status = func(container)
+            if status:
+                progress.update(container.name, status)
+
+        parallel_map(run, containers, workers=parallel)
+
+    def stop(self, service_names=None, include_deps=False, parallel=1,
+             **options):
+
+        def stop(container):
+            container.stop(**options)
+            return 'stopped'
+
+        try:
+            if parallel <= 1 and not include_deps:
+                super(Project, self).stop(service_names=service_names,
+                                          **options)
+            else:
+                self._each_container(stop, service_names=service_names,
+                                     include_deps=include_deps,
+                                     parallel=parallel)
+        finally:
+            self.snapshot.refresh()
+
+    def kill(self, service_names=None, **options):
+        try:
+            super(Project, self).kill(service_names=service_names, **options)
+        finally:
+            self.snapshot.refresh()
+
+    def restart(self, service_names=None, **options):
+        try:
+            super(Project, self).restart(service_names=service_names,
+                                         **options)
+        finally:
+            self.snapshot.refresh()
+
+    def remove_stopped(self, service_names=None, include_deps=False,
+                       parallel=1, **options):
+
+        def remove(container):
+            if container.is_running:
+                return None
+            container.remove(**options)
+            return 'removed'
+
+        try:
+            if parallel <= 1 and not include_deps:
+                super(Project, self).remove_stopped(
+                    service_names=service_names, **options)
+            else:
+                self._each_container(remove, service_names=service_names,
+                                     include_deps=include_deps, stopped=True,
+                                     parallel=parallel)
+        finally:
+            self.snapshot.refresh()
 
     def execute(self, service_name=None, **options):
         service = self.get_service(service_name or self.simple_name)
         service.execute(**options)
+
+
+class ProjectRef(object):
+    """Lightweight project descriptor, the project is built on first access to
+    any other attribute.
+    """
+
+    def __init__(self, bag8_name, prefix=None):
+        self._project = None
+        self.bag8_name = bag8_name
+        self.prefix = prefix
+
+    def __repr__(self):
+        return '<ProjectRef {0}:{1}>'.format(self.prefix, self.bag8_name)
+
+    def __getattr__(self, name):
+        return getattr(self.project, name)
+
+    @property
+    def simple_name(self):
+        return simple_name(self.bag8_name)
+
+    @property
+    def project(self):
+        if self._project is None:
+            self._project = Project(self.bag8_name, prefix=self.prefix)
+        return self._project
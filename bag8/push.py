@@ -0,0 +1,75 @@
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import threading
+
+from docker.errors import APIError
+
+from bag8.config import Config
+from bag8.project import Project
+from bag8.utils import Progress
+from bag8.utils import normalize_image
+from bag8.utils import parallel_map
+from bag8.utils import write_atomic
+
+
+class PushCache(object):
+    """Local id and registry digest of the last pushed images, kept in
+    tmpfolder/pushed.json.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as fd:
+                self.images = json.load(fd)
+        except (IOError, ValueError):
+            self.images = {}
+
+    def is_pushed(self, image, image_id):
+        pushed = self.images.get(image)
+        return bool(image_id and pushed and pushed['id'] == image_id)
+
+    def add(self, image, image_id, digest):
+        with self._lock:
+            self.images[image] = {'id': image_id, 'digest': digest}
+
+    def dump(self):
+        with self._lock:
+            write_atomic(self.path, json.dumps(self.images, indent=2,
+                                               sort_keys=True))
+
+
+def push_projects(names, insecure_registry=False, parallel=1, force=False):
+    """Pushes the project images not pushed since they were built, each
+    image once, concurrently.
+    """
+    cache = PushCache(os.path.join(Config.get().tmpfolder, 'pushed.json'))
+    progress = Progress()
+
+    services = {}
+    for name in names:
+        project = Project(name)
+        service = project.get_service(project.simple_name)
+        services.setdefault(normalize_image(service.image_name), service)
+
+    def push(image):
+        service = services[image]
+        try:
+            image_id = service.client.inspect_image(image)['Id']
+        except APIError:
+            # not built, the push reports it
+            image_id = None
+        if not force and cache.is_pushed(image, image_id):
+            progress.update(image, 'up to date')
+            return
+        digest = service.push(insecure_registry=insecure_registry,
+                              progress=progress)
+        cache.add(image, image_id, digest)
+
+    try:
+        parallel_map(push, sorted(services), workers=parallel)
+    finally:
+        cache.dump()
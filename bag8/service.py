@@ -1,8 +1,13 @@
 from __future__ import absolute_import, division, print_function
 
+import json
 import os
+import re
 import shlex
 import sys
+import threading
+
+from functools import partial
 
 import click
 
@@ -10,36 +15,163 @@ import dockerpty
 
 from docker.errors import APIError
 
+from compose.const import LABEL_PROJECT
+from compose.const import LABEL_SERVICE
 from compose.container import Container
+from compose.progress_stream import StreamOutputError
 from compose.progress_stream import stream_output
+from compose.service import BuildError
 from compose.service import Service as ComposeService
 from compose.service import parse_repository_tag
 
 from bag8.config import Config
+from bag8.const import LABEL_BAG8_IMAGE
 from bag8.const import LABEL_BAG8_PROJECT
 from bag8.const import LABEL_BAG8_SERVICE
-from bag8.utils import exec_, wait_
+from bag8.context import build_context
+from bag8.context import format_size
+from bag8.healthcheck import get_health_check
+from bag8.healthcheck import wait_health_check
+from bag8.utils import exec_, parallel_map, wait_all
+
+
+# layer status once pulled or pushed
+LAYER_DONE = [
+    'Already exists',
+    'Download complete',
+    'Image already exists',
+    'Image already pushed, skipping',
+    'Image successfully pushed',
+    'Pull complete',
+]
+
+RE_BUILT = re.compile(r'Successfully built ([0-9a-f]+)')
+RE_DIGEST = re.compile(r'digest: (\S+)')
+
+
+def stream_digest(events):
+    """Returns the digest a push stream ends with, None for old registries.
+    """
+    for event in events:
+        match = RE_DIGEST.search(event.get('status', ''))
+        if match:
+            return match.group(1)
+
+
+def follow_stream(output, name, progress):
+    """Reports a pull or push stream as a layers summary per image, returns
+    the pushed digest if any.
+    """
+    layers = {}
+    digest = None
+    for chunk in output:
+        event = json.loads(chunk)
+        if 'errorDetail' in event:
+            raise StreamOutputError(event['errorDetail']['message'])
+        digest = stream_digest([event]) or digest
+        status = event.get('status', '')
+        if 'id' in event and 'progressDetail' in event:
+            layers[event['id']] = status
+            done = len([s for s in layers.values() if s in LAYER_DONE])
+            progress.update(name, '{0}/{1} layers'.format(done, len(layers)))
+    progress.update(name, 'done')
+    return digest
+
+
+def image_built(events):
+    """Returns the id of the image built by a build stream.
+    """
+    for event in events:
+        match = RE_BUILT.search(event.get('stream', ''))
+        if match:
+            return match.group(1)
+    raise StreamOutputError('no image built')
+
+
+def follow_build(output, name, progress):
+    """Reports a build stream as its current step, returns the image id.
+    """
+    events = []
+    for chunk in output:
+        event = json.loads(chunk)
+        if 'errorDetail' in event:
+            raise StreamOutputError(event['errorDetail']['message'])
+        line = event.get('stream', '').strip()
+        if line.startswith('Step '):
+            progress.update(name, line)
+        events.append(event)
+    image_id = image_built(events)
+    progress.update(name, 'done')
+    return image_id
+
+
+class ContainerSnapshot(object):
+    """Project containers listed once with the project label and indexed by
+    service, refresh it, or the changed service entry, after state changes.
+    """
+
+    def __init__(self, client, project):
+        self.client = client
+        self.project = project
+        self._containers = None
+        self._stale = set()
+        self._lock = threading.Lock()
+
+    def refresh(self, service=None):
+        with self._lock:
+            if service is None:
+                self._containers = None
+                self._stale.clear()
+            else:
+                self._stale.add(service)
+
+    def _list(self, service=None):
+        labels = ['{0}={1}'.format(LABEL_PROJECT, self.project)]
+        if service is not None:
+            labels.append('{0}={1}'.format(LABEL_SERVICE, service))
+        return self.client.containers(all=True, filters={'label': labels})
+
+    def get(self, service, labels, stopped=False):
+        with self._lock:
+            if self._containers is None:
+                self._containers = {}
+                self._stale.clear()
+                for c in self._list():
+                    name = (c.get('Labels') or {}).get(LABEL_SERVICE)
+                    self._containers.setdefault(name, []).append(c)
+            elif service in self._stale:
+                self._containers[service] = self._list(service)
+                self._stale.discard(service)
+            containers = list(self._containers.get(service, []))
+        labels = [l.split('=', 1) for l in labels]
+        return [c for c in containers
+                if (stopped or c['Status'].startswith('Up'))
+                and all(c['Labels'].get(k) == v for k, v in labels)]
 
 
 class Service(ComposeService):
 
     def __init__(self, name, bag8_name='', bag8_project='', image_name=None,
-                 **kwargs):
+                 snapshot=None, healthcheck=None, **kwargs):
         super(Service, self).__init__(name, **kwargs)
         self.bag8_name = bag8_name
         self.bag8_project = bag8_project
+        self.snapshot = snapshot
         # hack to propagate build path and image name
         if 'dockerfile' in self.options:
             self.options['build'] = os.path.dirname(self.options['dockerfile'])
             del self.options['dockerfile']
+        # bag8 extension, not a compose option
+        self.healthcheck = healthcheck
 
     def containers(self, stopped=False, one_off=False, bag8_labels=False):
-        return [
-            Container.from_ps(self.client, container)
-            for container in self.client.containers(
-                all=stopped,
-                filters={'label': self.labels(one_off=one_off,
-                                              bag8_labels=bag8_labels)})]
+        labels = self.labels(one_off=one_off, bag8_labels=bag8_labels)
+        if self.snapshot is not None:
+            containers = self.snapshot.get(self.name, labels, stopped=stopped)
+        else:
+            containers = self.client.containers(all=stopped,
+                                                filters={'label': labels})
+        return [Container.from_ps(self.client, c) for c in containers]
 
     def labels(self, one_off=False, bag8_labels=True):
         labels = super(Service, self).labels(one_off=one_off)
@@ -54,8 +186,32 @@ class Service(ComposeService):
     def image_name(self):
         return self.options['image']
 
-    def build(self, no_cache=False):
-        super(Service, self).build(no_cache=no_cache)
+    def build(self, no_cache=False, progress=None):
+        context, size = build_context(self.options['build'], labels={
+            LABEL_BAG8_IMAGE: self.bag8_name,
+        })
+        status = 'context {0}'.format(format_size(size))
+        if progress is not None:
+            progress.update(self.image_name, status)
+        else:
+            click.echo('Building {0} ({1})...'.format(self.name, status))
+        try:
+            output = self.client.build(
+                fileobj=context,
+                custom_context=True,
+                tag=self.image_name,
+                stream=True,
+                rm=True,
+                pull=False,
+                nocache=no_cache,
+            )
+            if progress is not None:
+                return follow_build(output, self.image_name, progress)
+            return image_built(stream_output(output, sys.stdout))
+        except StreamOutputError as e:
+            raise BuildError(self, str(e))
+        finally:
+            context.close()
 
     def rmi(self, force=False):
         try:
@@ -66,18 +222,38 @@ class Service(ComposeService):
                 raise e
             click.echo('image not found: {0}'.format(self.image_name))
 
-    def push(self, insecure_registry=False):
+    def pull(self, insecure_registry=False, progress=None):
+        if progress is None:
+            return super(Service, self).pull(
+                insecure_registry=insecure_registry)
+        if 'image' not in self.options:
+            return
+        repo, tag = parse_repository_tag(self.options['image'])
+        tag = tag or 'latest'
+        output = self.client.pull(
+            repo,
+            tag=tag,
+            stream=True,
+            insecure_registry=insecure_registry)
+        follow_stream(output, '{0}:{1}'.format(repo, tag), progress)
+
+    def push(self, insecure_registry=False, progress=None):
+        """Pushes the service image, returns the digest given by the registry.
+        """
         if 'image' not in self.options:
             return
         repo, tag = parse_repository_tag(self.options['image'])
         tag = tag or 'latest'
-        click.echo('Pushing %s (%s:%s)...' % (self.name, repo, tag))
+        if progress is None:
+            click.echo('Pushing %s (%s:%s)...' % (self.name, repo, tag))
         output = self.client.push(
             repo,
             tag=tag,
             stream=True,
             insecure_registry=insecure_registry)
-        stream_output(output, sys.stdout)
+        if progress is None:
+            return stream_digest(stream_output(output, sys.stdout))
+        return follow_stream(output, '{0}:{1}'.format(repo, tag), progress)
 
     def run(self, command=None, detach=False, insecure_registry=False,
             interactive=True, remove=False, tty=None):
@@ -107,17 +283,30 @@ class Service(ComposeService):
         sys.exit(exit_code)
 
     def wait_links(self):
-        config = Config()
+        config = Config.get()
         # do not use the wait behaviour
         if config.skip_wait:
             return
+        addresses = []
+        checks = []
         for service, name in self.links:
+            host = '{}.{}'.format(service.bag8_name, config.domain_suffix)
+            check = get_health_check(service, host)
+            if check:
+                checks.append(check)
+                continue
             for ports in service.options.get('expose', []):
                 if not ports:
                     continue
-                host = '{}.{}'.format(service.bag8_name, config.domain_suffix)
                 port_to_wait = str(ports).split(':')[0]
-                wait_(host, port_to_wait, max_retry=config.wait_seconds)
+                addresses.append((host, port_to_wait))
+        # all at once
+        waits = [partial(wait_health_check, c, max_wait=config.wait_seconds)
+                 for c in checks]
+        if addresses:
+            waits.append(partial(wait_all, addresses,
+                                 max_wait=config.wait_seconds))
+        parallel_map(lambda wait: wait(), waits, workers=len(waits))
 
     def start(self, one_off=False, **options):
         for c in self.containers(stopped=True, one_off=one_off):
@@ -138,8 +327,22 @@ class Service(ComposeService):
             sys.exit(exit_code)
         else:
             container.start(**options)
+            self._refresh_snapshot()
         return container
 
+    def _refresh_snapshot(self):
+        # links health checks list this service containers while the command
+        # runs
+        if self.snapshot is not None:
+            self.snapshot.refresh(self.name)
+
+    def execute_convergence_plan(self, plan, **options):
+        try:
+            return super(Service, self).execute_convergence_plan(plan,
+                                                                 **options)
+        finally:
+            self._refresh_snapshot()
+
     def execute(self, one_off=False, **options):
         for c in self.containers(one_off=one_off):
             self.execute_container(c, **options)
@@ -74,6 +74,34 @@ def _setup(config_path, slave_id):
     check_call(['bag8', 'build', 'busybox'])
 
 
+@pytest.fixture(scope='function')
+def data_tree(tmpdir, config_path, _setup):
+    """Returns a function to write projects to a new data path, ex.:
+    data_tree({'a': ['b'], 'b': []}) writes a/fig.yml linked to b.
+    """
+    data_path = tmpdir.mkdir('data')
+
+    with open(config_path) as fo:
+        settings = yaml.load(fo)
+    settings[b'data_paths'] = [str(data_path)]
+    with open(config_path, 'w') as fo:
+        yaml.dump(settings, fo, indent=2, default_flow_style=False, width=80)
+
+    def write(projects):
+        for name, links in projects.items():
+            project_path = data_path.mkdir(name)
+            project_path.join('Dockerfile').write('FROM busybox')
+            project_path.join('fig.yml').write(yaml.dump({
+                b'app': {
+                    b'image': 'bag8/{0}'.format(name),
+                    b'links': links,
+                },
+            }, default_flow_style=False))
+        return data_path
+
+    return write
+
+
 def _rm_all(slave_id):
     try:
         check_call(['bag8', 'rm', 'busybox', '-p', slave_id])
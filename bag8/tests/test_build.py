@@ -0,0 +1,196 @@
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import os
+import shutil
+import tarfile
+import threading
+
+from docker.errors import APIError
+from mock import Mock
+from mock import patch
+
+import pytest
+
+from bag8.build import BuildManifest
+from bag8.build import BuildPlan
+from bag8.build import dockerfile_bases
+from bag8.exceptions import NoDockerfile
+from bag8.service import Service
+
+
+def _tree(data_tree):
+    # base <- mid <- (a, b), c alone
+    data_path = data_tree({'base': [], 'mid': [], 'a': [], 'b': [], 'c': []})
+    for name, base in [('base', 'debian:8'), ('mid', 'bag8/base'),
+                       ('a', 'bag8/mid:latest'), ('b', 'bag8/mid'),
+                       ('c', 'busybox')]:
+        data_path.join(name, 'Dockerfile').write(
+            '# comment\nfrom {0}\nRUN true\n'.format(base))
+    data_path.mkdir('nodockerfile').join('fig.yml').write('app: {}')
+    return data_path
+
+
+def test_dockerfile_bases(tmpdir):
+
+    path = tmpdir.join('Dockerfile')
+    path.write('FROM a AS builder\nRUN make\n  from b:1.0\n')
+    assert dockerfile_bases(str(path)) == ['a:latest', 'b:1.0']
+
+
+def test_build_plan(data_tree):
+
+    _tree(data_tree)
+
+    plan = BuildPlan(['a', 'b'])
+    assert plan.names == ['a', 'b', 'mid', 'base']
+    assert plan.deps('a') == ['mid']
+    assert plan.deps('base') == []
+
+    assert BuildPlan(['a', 'b'], bases=False).names == ['a', 'b']
+    assert sorted(BuildPlan().names) == ['a', 'b', 'base', 'c', 'mid']
+
+    with pytest.raises(NoDockerfile):
+        BuildPlan(['nodockerfile'])
+
+
+def test_build_plan_lazy_scan(data_tree):
+
+    _tree(data_tree)
+
+    # bases all known from the planned projects
+    with patch.object(BuildPlan, '_scan') as scan:
+        plan = BuildPlan(['a', 'mid', 'base'], bases=False)
+        assert plan.deps('a') == ['mid']
+        assert plan.deps('mid') == ['base']
+    assert scan.called is False
+
+    plan = BuildPlan(['a'])
+    assert plan._scanned is True
+    assert plan.names == ['a', 'mid', 'base']
+
+
+def test_build_parallel(data_tree):
+
+    _tree(data_tree)
+
+    built = []
+    lock = threading.Lock()
+
+    def build(service, no_cache=False, progress=None):
+        assert progress is not None
+        with lock:
+            built.append(service.bag8_name)
+        return service.bag8_name
+
+    with patch.object(Service, 'build', autospec=True, side_effect=build), \
+            patch.object(BuildPlan, 'base_ids', return_value=[]):
+        results = BuildPlan(['a', 'b', 'c']).build(parallel=4, force=True)
+
+    # each image once, bases first
+    assert sorted(built) == ['a', 'b', 'base', 'c', 'mid']
+    assert built.index('base') < built.index('mid') < built.index('a')
+    assert built.index('mid') < built.index('b')
+    assert results['a'] == 'a'
+
+
+def test_build_manifest(data_tree, local_path):
+
+    data_path = _tree(data_tree)
+    shutil.rmtree(os.path.join(local_path, 'build'), ignore_errors=True)
+    images = {}
+
+    def inspect_image(name):
+        name = name.replace(':latest', '')
+        if name not in images:
+            raise APIError('', Mock())
+        return {'Id': images[name]}
+
+    def build(service, no_cache=False, progress=None):
+        images[service.image_name] = '{0:012x}{1}'.format(len(built), 'f' * 52)
+        built.append(service.bag8_name)
+        return images[service.image_name][:12]
+
+    def run(**kwargs):
+        del built[:]
+        with patch.object(Service, 'build', autospec=True,
+                          side_effect=build), \
+                patch('docker.Client.inspect_image',
+                      side_effect=inspect_image):
+            BuildPlan(['a', 'c']).build(**kwargs)
+        return sorted(built)
+
+    built = []
+    assert run() == ['a', 'base', 'c', 'mid']
+    assert os.path.exists(os.path.join(local_path, 'build', 'a.json'))
+
+    # nothing changed
+    assert run() == []
+    assert run(force=True) == ['a', 'base', 'c', 'mid']
+    assert run(no_cache=True) == ['a', 'base', 'c', 'mid']
+
+    # base context changed: new base image id, rebuilds what depends on it
+    data_path.join('mid', 'script.sh').write('true')
+    assert run() == ['a', 'mid']
+
+    # image removed or replaced
+    del images['bag8/c']
+    assert run() == ['c']
+
+    # ids with digest algorithm
+    images['bag8/c'] = 'sha256:' + images['bag8/c']
+    assert run() == []
+
+    # touched only: skipped, refreshed hashes kept
+    path = data_path.join('c', 'Dockerfile')
+    path.setmtime(path.mtime() + 10)
+    assert run() == []
+    manifest = BuildManifest(BuildPlan(['c']).project('c'))
+    assert manifest.files['Dockerfile'][0] == os.lstat(str(path)).st_mtime
+
+    manifest = BuildManifest(BuildPlan(['c']).project('c'))
+    assert sorted(manifest.files) == ['Dockerfile', 'fig.yml']
+
+
+def test_service_build(data_tree):
+
+    data_path = _tree(data_tree)
+    data_path.join('c', '.bag8ignore').write('fig.yml\n')
+    project = BuildPlan(['c']).project('c')
+    service = project.get_service('c')
+
+    def build(**kwargs):
+        assert kwargs['custom_context']
+        assert kwargs['tag'] == 'bag8/c'
+        names = tarfile.open(fileobj=kwargs['fileobj']).getnames()
+        assert sorted(names) == ['.bag8ignore', 'Dockerfile']
+        return iter([
+            '{"stream": "Step 0 : FROM busybox\\n"}',
+            '{"stream": "Successfully built 0123456789ab\\n"}',
+        ])
+
+    progress = Mock()
+    with patch('docker.Client.build', side_effect=build):
+        assert service.build(progress=progress) == '0123456789ab'
+        assert service.build() == '0123456789ab'
+    statuses = [c[0][1] for c in progress.update.call_args_list]
+    assert statuses == ['context 10.0 KB', 'Step 0 : FROM busybox', 'done']
+
+
+def test_build_manifest_symlinks(data_tree):
+
+    data_path = _tree(data_tree)
+    project_path = data_path.join('c')
+    os.symlink('missing', str(project_path.join('dangling')))
+    project_path.mkdir('empty')
+    manifest = BuildManifest(BuildPlan(['c']).project('c'))
+
+    fingerprint = manifest.compute()
+    assert manifest.files['dangling'][2] == hashlib.sha1(
+        b'missing').hexdigest()
+    assert manifest.files['empty'][2] is None
+
+    # link target changed
+    project_path.join('dangling').remove()
+    os.symlink('other', str(project_path.join('dangling')))
+    assert manifest.compute() != fingerprint
@@ -1,12 +1,19 @@
 from __future__ import absolute_import, division, print_function
 
 import os
+import sys
 import tempfile
 
 from functools import partial
 
 import pytest
 
+from click.testing import CliRunner
+from docker.errors import APIError
+from mock import Mock
+from mock import patch
+
+from bag8.cli import bag8
 from bag8.project import Project
 from bag8.utils import check_call as base_check_call
 from bag8.utils import inspect
@@ -14,6 +21,70 @@ from bag8.utils import inspect
 
 check_call = partial(base_check_call, exit=False)
 
+# modules --help and shell completion should not load
+HEAVY_MODULES = ['compose', 'docker', 'dockerpty', 'jinja2', 'requests',
+                 'yaml']
+
+# seconds, about ten times the current import time
+IMPORT_BUDGET = 0.5
+
+
+def test_import_time():
+
+    script = '\n'.join([
+        'import sys',
+        'from time import time',
+        'start = time()',
+        'import bag8.cli',
+        'print(time() - start)',
+        'print(" ".join(sorted(set(m.split(".")[0] for m in sys.modules))))',
+    ])
+    # best of 3, first one warms the .pyc and filesystem caches
+    timings = []
+    for _ in range(3):
+        out, err, code = check_call([sys.executable, '-c', script])
+        duration, modules = out.decode('utf-8').splitlines()
+        timings.append(float(duration))
+
+    assert not set(HEAVY_MODULES) & set(modules.split())
+    assert min(timings) < IMPORT_BUDGET
+
+    # nor the commands help
+    script = '\n'.join([
+        'import sys',
+        'from bag8.cli import bag8',
+        'try:',
+        '    bag8(sys.argv[1:], prog_name="bag8")',
+        'except SystemExit:',
+        '    pass',
+        'sys.stderr.write(" ".join(sorted(set(m.split(".")[0]',
+        '                                     for m in sys.modules))))',
+    ])
+    for args in [['--help'], ['build', '--help'], ['up', '--help'],
+                 ['rmi', '--help']]:
+        out, err, code = check_call([sys.executable, '-c', script] + args)
+        assert 'Usage:' in out.decode('utf-8')
+        assert not set(HEAVY_MODULES) & set(err.decode('utf-8').split())
+
+
+def test_complete_imports():
+
+    script = '\n'.join([
+        'import sys',
+        'from bag8.cli import bag8',
+        'try:',
+        '    bag8(["complete", "projects"], prog_name="bag8")',
+        'except SystemExit:',
+        '    pass',
+        'sys.stderr.write(" ".join(sorted(set(m.split(".")[0]',
+        '                                     for m in sys.modules))))',
+    ])
+    # first run writes the projects index
+    check_call([sys.executable, '-c', script])
+    out, err, code = check_call([sys.executable, '-c', script])
+    assert 'busybox' in out.decode('utf-8').split()
+    assert not set(HEAVY_MODULES) & set(err.decode('utf-8').split())
+
 
 @pytest.mark.exclusive
 @pytest.mark.needdocker()
@@ -340,3 +411,22 @@ def test_up(slave_id):
     # check container exist
     p = Project('busybox', prefix=slave_id)
     assert len(p.containers(['busybox'])) == 1
+
+
+def test_rmi_exit_code():
+
+    def remove_image(name, force=False):
+        if name == 'bag8/link':
+            raise APIError('conflict', Mock(), explanation='in use')
+
+    images = [{'Id': 'a1', 'RepoTags': ['bag8/busybox:latest']},
+              {'Id': 'b1', 'RepoTags': ['bag8/link:latest']}]
+    runner = CliRunner()
+    with patch('docker.Client.images', return_value=images[:1]), \
+            patch('docker.Client.remove_image', side_effect=remove_image):
+        assert runner.invoke(bag8, ['rmi', 'busybox']).exit_code == 0
+    with patch('docker.Client.images', return_value=images), \
+            patch('docker.Client.remove_image', side_effect=remove_image):
+        result = runner.invoke(bag8, ['rmi', 'busybox'])
+    assert result.exit_code == 1
+    assert 'bag8/link: not removed, in use' in result.output
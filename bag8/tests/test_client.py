@@ -0,0 +1,15 @@
+from __future__ import absolute_import, division, print_function
+
+from bag8.client import get_client
+from bag8.project import Project
+
+
+def test_get_client():
+
+    client = get_client()
+    assert Project('busybox').client is client
+    assert Project('link').client is client
+
+    # keep-alive connections for concurrent calls
+    pool = client.get_adapter(client.base_url).get_connection(client.base_url)
+    assert pool.pool.maxsize == 10
@@ -0,0 +1,36 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+
+from bag8.complete import project_names
+from bag8.complete import service_names
+from bag8.project import Project
+from bag8.yaml import Yaml
+
+
+def test_project_names(data_tree, local_path):
+
+    data_path = data_tree({'a': [], 'b': ['a']})
+
+    # no index yet, built from the config
+    assert project_names() == ['a', 'b']
+    assert os.path.exists(os.path.join(local_path, 'projects.json'))
+
+    # refreshed on data path change
+    data_path.mkdir('c').join('fig.yml').write('app: {}')
+    os.utime(str(data_path), (0, 0))
+    assert project_names() == ['a', 'b', 'c']
+
+
+def test_service_names(data_tree, local_path):
+
+    data_tree({'a': [], 'b': ['a']})
+    shutil.rmtree(os.path.join(local_path, 'render'), ignore_errors=True)
+
+    # not rendered yet
+    assert service_names('b') == []
+
+    Yaml(Project('b')).data
+    assert service_names('b') == ['a', 'b']
+    assert service_names('a') == []
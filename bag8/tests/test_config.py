@@ -1,4 +1,9 @@
+import os
+
+from mock import patch
+
 from bag8.config import Config
+from bag8.index import ProjectIndex
 
 
 def test_iter_data_paths():
@@ -17,3 +22,42 @@ def test_iter_data_paths():
     config._data_paths = ['dummy']
     # should not return valid path/project tuple
     assert not [path for path, project in config.iter_data_paths()]
+
+
+def test_project_index(tmpdir):
+
+    index_path = tmpdir.join('projects.json')
+    data_path = tmpdir.mkdir('data')
+    data_path.mkdir('one').join('fig.yml').write('app: {}')
+    data_path.mkdir('nofig')
+
+    index = ProjectIndex([str(data_path), 'dummy'],
+                         cache_path=str(index_path))
+    assert index.get_path('one') == str(data_path.join('one'))
+    assert index.get_path('nofig') is None
+    assert index.names == ['one']
+    assert index_path.check()
+
+    # new project dir updates the data path mtime
+    data_path.mkdir('two').join('fig.yml').write('app: {}')
+    os.utime(str(data_path), (0, 0))
+    assert index.get_path('two') == str(data_path.join('two'))
+
+    # another process reuses the cache file
+    index = ProjectIndex([str(data_path), 'dummy'],
+                         cache_path=str(index_path))
+    with patch('bag8.index.ProjectIndex._scan') as mock:
+        assert index.get_path('two') == str(data_path.join('two'))
+    assert not mock.called
+
+
+def test_get(config_path):
+
+    config = Config.get()
+    assert Config.get() is config
+
+    # reloads on config file change
+    with open(config_path, 'a') as fo:
+        fo.write('domain_suffix: local\n')
+    assert Config.get() is not config
+    assert Config.get().domain_suffix == 'local'
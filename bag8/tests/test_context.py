@@ -0,0 +1,98 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import tarfile
+
+from bag8.context import build_context
+from bag8.context import format_size
+from bag8.context import iter_context
+
+
+def _context(tmpdir):
+    root = tmpdir.mkdir('project')
+    root.join('Dockerfile').write('FROM busybox')
+    root.join('app.py').write('print(1)')
+    root.join('app.pyc').write('...')
+    root.mkdir('node_modules').mkdir('left').join('index.js').write('')
+    root.mkdir('src').join('main.py').write('')
+    root.join('src', 'main.pyc').write('')
+    root.join('.dockerignore').write('*.pyc\n')
+    root.join('.bag8ignore').write('# deps\nnode_modules/\nsrc/*.pyc\n'
+                                   'Dockerfile\n')
+    return root
+
+
+def test_iter_context(tmpdir):
+
+    root = _context(tmpdir)
+    assert list(iter_context(str(root))) == [
+        '.bag8ignore', '.dockerignore', 'Dockerfile', 'app.py', 'src',
+        'src/main.py',
+    ]
+
+
+def test_build_context(tmpdir):
+
+    root = _context(tmpdir)
+    context, size = build_context(str(root))
+    assert size == os.fstat(context.fileno()).st_size
+    assert context.tell() == 0
+    with tarfile.open(fileobj=context) as tar:
+        assert sorted(tar.getnames()) == sorted(iter_context(str(root)))
+
+
+def test_format_size():
+
+    assert format_size(12) == '12 B'
+    assert format_size(2048) == '2.0 KB'
+    assert format_size(5 * 1024 ** 2 + 1024 ** 2 // 2) == '5.5 MB'
+    assert format_size(3 * 1024 ** 4) == '3072.0 GB'
+
+
+def test_build_context_labels(tmpdir):
+
+    root = _context(tmpdir)
+    context, size = build_context(str(root), labels={'a.b': 'c d'})
+    with tarfile.open(fileobj=context) as tar:
+        dockerfile = tar.extractfile('Dockerfile').read()
+    assert dockerfile == b'FROM busybox\n\nLABEL "a.b"="c d"\n'
+
+    root.join('Dockerfile').write('FROM busybox\nRUN true\n')
+    context, size = build_context(str(root), labels={'a': 'b'})
+    with tarfile.open(fileobj=context) as tar:
+        dockerfile = tar.extractfile('Dockerfile').read()
+    assert dockerfile == b'FROM busybox\nRUN true\n\nLABEL "a"="b"\n'
+
+
+def test_iter_context_dirs(tmpdir):
+
+    root = _context(tmpdir)
+    root.mkdir('empty')
+    root.join('node_modules').mkdir('empty')
+    os.symlink('src', str(root.join('linked')))
+    os.symlink('missing', str(root.join('dangling')))
+    assert list(iter_context(str(root))) == [
+        '.bag8ignore', '.dockerignore', 'Dockerfile', 'app.py', 'dangling',
+        'linked', 'empty', 'src', 'src/main.py',
+    ]
+
+    context, size = build_context(str(root))
+    with tarfile.open(fileobj=context) as tar:
+        assert tar.getmember('empty').isdir()
+        assert tar.getmember('linked').issym()
+        assert tar.getmember('linked').linkname == 'src'
+        assert 'linked/main.py' not in tar.getnames()
+
+
+def test_build_context_dir_mode(tmpdir):
+
+    root = _context(tmpdir)
+    os.chmod(str(root.join('src')), 0o775)
+    context, size = build_context(str(root))
+    with tarfile.open(fileobj=context) as tar:
+        names = tar.getnames()
+        src = tar.getmember('src')
+    assert src.isdir()
+    assert src.mode & 0o7777 == 0o775
+    # the dir comes before its content
+    assert names.index('src') < names.index('src/main.py')
@@ -0,0 +1,78 @@
+from __future__ import absolute_import, division, print_function
+
+from docker.errors import APIError
+from mock import Mock
+
+import pytest
+
+from bag8.exceptions import WaitLinkFailed
+from bag8.healthcheck import CommandCheck
+from bag8.healthcheck import HttpCheck
+from bag8.healthcheck import LogCheck
+from bag8.healthcheck import get_health_check
+from bag8.healthcheck import wait_health_check
+
+
+def _service(healthcheck=None, logs='', exit_code=0):
+    service = Mock(healthcheck=healthcheck, options={'expose': [1234]})
+    service.name = 'link'
+    service.containers.return_value = [Mock(id='abc')]
+    service.client.logs.return_value = logs
+    service.client.exec_inspect.return_value = {'ExitCode': exit_code}
+    return service
+
+
+def test_get_health_check():
+
+    assert get_health_check(_service(), 'link.docker') is None
+
+    check = get_health_check(_service({'http': '/health'}), 'link.docker')
+    assert isinstance(check, HttpCheck)
+    assert check.url == 'http://link.docker:1234/health'
+
+    check = get_health_check(_service({'http': '8080/'}), 'link.docker')
+    assert check.url == 'http://link.docker:8080/'
+
+    # nothing exposed
+    service = _service({'http': '/health'})
+    service.options = {'expose': []}
+    check = get_health_check(service, 'link.docker')
+    assert check.url == 'http://link.docker:80/health'
+
+    with pytest.raises(ValueError):
+        get_health_check(_service({'tcp': 1234}), 'link.docker')
+
+
+def test_checks():
+
+    service = _service(logs='starting\nready to accept connections\n')
+    assert LogCheck(service, 'link.docker', '^ready').check()
+    assert not LogCheck(service, 'link.docker', '^listening').check()
+
+    service = _service(exit_code=1)
+    assert not CommandCheck(service, 'link.docker', 'pg_isready').check()
+    service.client.exec_create.assert_called_with('abc', 'pg_isready')
+
+    # no running container
+    service.containers.return_value = []
+    assert not CommandCheck(service, 'link.docker', 'pg_isready').check()
+
+    # container gone during the wait
+    service = _service()
+    service.client.exec_create.side_effect = APIError('', Mock())
+    service.client.logs.side_effect = APIError('', Mock())
+    assert not CommandCheck(service, 'link.docker', 'pg_isready').check()
+    assert not LogCheck(service, 'link.docker', '^ready').check()
+
+
+def test_wait_health_check():
+
+    check = Mock()
+    check.check.side_effect = [False, False, True]
+    wait_health_check(check, max_wait=5, backoff=0.01)
+    assert check.check.call_count == 3
+
+    check.check.side_effect = None
+    check.check.return_value = False
+    with pytest.raises(WaitLinkFailed):
+        wait_health_check(check, max_wait=0.2, backoff=0.01)
@@ -0,0 +1,94 @@
+from __future__ import absolute_import, division, print_function
+
+from time import time
+
+from docker.errors import APIError
+from mock import Mock
+from mock import patch
+
+from bag8.images import ImageInventory
+from bag8.images import prune_images
+from bag8.project import Project
+
+
+DAY = 24 * 3600
+
+IMAGES = [
+    {'Id': 'a1', 'Created': time(), 'RepoTags': ['bag8/busybox:latest'],
+     'Labels': {'com.docker.compose.bag8-image': 'busybox'}},
+    {'Id': 'b1', 'Created': time() - 10 * DAY,
+     'RepoTags': ['bag8/link:latest', 'bag8/link:1.0'],
+     'Labels': {'com.docker.compose.bag8-image': 'link'}},
+    {'Id': 'c1', 'Created': time() - 10 * DAY, 'RepoTags': ['<none>:<none>'],
+     'Labels': {'com.docker.compose.bag8-image': 'link'}},
+]
+
+
+def test_image_inventory():
+
+    client = Mock()
+    client.images.return_value = IMAGES
+    inventory = ImageInventory(client)
+    assert inventory.get('bag8/link')['Id'] == 'b1'
+    assert inventory.get('bag8/link:1.0')['Id'] == 'b1'
+    assert inventory.get('bag8/link:2.0') is None
+    assert '<none>:<none>' not in inventory.tags
+
+
+def test_project_rmi():
+
+    project = Project('busybox')
+    removed = []
+
+    def remove_image(name, force=False):
+        if name == 'bag8/link':
+            raise APIError('conflict', Mock(), explanation='in use')
+        removed.append(name)
+
+    with patch('docker.Client.images',
+               return_value=IMAGES[:1]) as images, \
+            patch('docker.Client.remove_image', side_effect=remove_image):
+        assert project.rmi(parallel=2) == (['bag8/busybox'], [])
+    # one listing, no removal of missing images
+    assert images.call_count == 1
+    assert removed == ['bag8/busybox']
+
+    with patch('docker.Client.images', return_value=IMAGES), \
+            patch('docker.Client.remove_image', side_effect=remove_image):
+        assert project.rmi(parallel=2) == (['bag8/busybox'], ['bag8/link'])
+
+
+def test_prune_images():
+
+    client = Mock()
+    client.images.return_value = IMAGES
+    assert prune_images(client, older_than=DAY, parallel=2) == ([
+        'bag8/link:1.0', 'bag8/link:latest', 'c1'], [])
+    assert client.images.call_args[1]['filters'] == {
+        'label': 'com.docker.compose.bag8-image'}
+
+    client = Mock()
+    client.images.return_value = IMAGES[2:]
+    assert prune_images(client, dangling=True) == (['c1'], [])
+    assert client.images.call_args[1]['filters']['dangling'] is True
+    client.remove_image.assert_called_once_with('c1', force=False)
+
+
+def test_prune_images_derived():
+
+    label = 'com.docker.compose.bag8-image'
+    client = Mock()
+    # built FROM bag8 images, labels inherited
+    client.images.return_value = [
+        {'Id': 'd1', 'Created': 0, 'RepoTags': ['other/app:latest'],
+         'Labels': {label: 'link'}},
+        {'Id': 'e1', 'Created': 0,
+         'RepoTags': ['bag8/link:latest', 'other/link:latest'],
+         'Labels': {label: 'link'}},
+        {'Id': 'f1', 'Created': 0, 'RepoTags': ['<none>:<none>'],
+         'Labels': {label: 'removed'}},
+    ]
+    assert prune_images(client, older_than=DAY) == (['bag8/link:latest'],
+                                                    [])
+    client.remove_image.assert_called_once_with('bag8/link:latest',
+                                                force=False)
@@ -1,10 +1,27 @@
 from __future__ import absolute_import, division, print_function
 
+from mock import PropertyMock
 from mock import patch
 
 import pytest
+import yaml
 
+from compose.container import Container
+
+from bag8.exceptions import CyclicDependency
 from bag8.project import Project
+from bag8.utils import Progress
+
+
+def _ps(prefix, name, service, status='Up 2 seconds', one_off='False'):
+    return {
+        'Id': name, 'Image': 'bag8/busybox', 'Names': ['/' + name],
+        'Status': status, 'Labels': {
+            'com.docker.compose.project': prefix,
+            'com.docker.compose.service': service,
+            'com.docker.compose.oneoff': one_off,
+        },
+    }
 
 
 @pytest.mark.exclusive
@@ -53,6 +70,24 @@ def test_pull_insecure_registry():
     mock.assert_called_with(insecure_registry=True)
 
 
+def test_pull_parallel(data_tree):
+
+    data_path = data_tree({
+        'a': ['b', 'c'],
+        'b': [],
+        'c': [],
+    })
+    # same image for b and c
+    data_path.join('c', 'fig.yml').write('app:\n  image: bag8/b\n')
+
+    project = Project('a')
+
+    with patch('bag8.service.Service.pull') as mock:
+        project.pull(parallel=4)
+    assert mock.call_count == 2
+    assert isinstance(mock.call_args[1]['progress'], Progress)
+
+
 @pytest.mark.needdocker()
 def test_iter_projects(slave_id):
 
@@ -79,6 +114,37 @@ def test_iter_projects(slave_id):
     ] if c in containers]
 
 
+def test_iter_projects_refs():
+
+    def ps(prefix, name):
+        return {'Labels': {
+            'com.docker.compose.project': prefix,
+            'com.docker.compose.bag8-service': name,
+        }}
+
+    with patch('bag8.project.get_client') as mock:
+        mock.return_value.containers.return_value = [
+            ps('a', 'busybox'),
+            ps('a', 'link'),
+            ps('a', 'busybox'),
+            ps('b', 'link.2'),
+        ]
+        with patch.object(Project, '__init__') as init:
+            refs = list(Project.iter_projects())
+            assert [(r.prefix, r.bag8_name, r.simple_name) for r in refs] == [
+                ('a', 'busybox', 'busybox'),
+                ('a', 'link', 'link'),
+                ('b', 'link.2', 'link2'),
+            ]
+            # no project built yet
+            assert not init.called
+    mock.return_value.containers.assert_called_with(filters={
+        'label': 'com.docker.compose.bag8-service'})
+
+    # built on demand
+    assert refs[2].bag8_path.endswith('link.2')
+
+
 def test_project_environment():
     project = Project('busybox')
     assert project.environment == {
@@ -91,3 +157,166 @@ def test_project_environment():
     }
     project = Project('link.2')
     assert project.environment == {}
+
+
+def test_deps_names(data_tree):
+
+    data_tree({
+        'a': ['b', 'c'],
+        'b': ['d'],
+        'c': ['d', 'b'],
+        'd': [],
+    })
+
+    # deps first, each once
+    assert Project('a').deps_names == ['d', 'b', 'c']
+    assert Project('c').deps_names == ['d', 'b']
+    assert Project('d').deps_names == []
+
+    # same project instances
+    project = Project('a')
+    assert project.deps[0] is project.deps[1].deps[0]
+
+
+def test_deps_names_cycle(data_tree):
+
+    data_tree({
+        'a': ['b'],
+        'b': ['c'],
+        'c': ['a'],
+    })
+
+    with pytest.raises(CyclicDependency) as e:
+        Project('a').deps_names
+    assert str(e.value) == 'a -> b -> c -> a'
+
+
+def test_containers_snapshot():
+
+    project = Project('busybox', prefix='snap')
+
+    with patch.object(project.client, 'containers') as mock:
+        mock.return_value = [
+            _ps('snap', 'snap_busybox_1', 'busybox'),
+            _ps('snap', 'snap_link_1', 'link',
+                status='Exited (0) 1 second ago'),
+            _ps('snap', 'snap_link_run_1', 'link', one_off='True'),
+        ]
+        assert project.get_container_name() == 'snap_busybox_1'
+        assert project.get_container_name('link') is None
+        assert project.get_container_name('link', stopped=True) == \
+            'snap_link_1'
+        # one listing for all the calls
+        assert mock.call_count == 1
+
+        # listed again after a state change
+        with patch('compose.service.Service.stop'):
+            project.stop()
+        project.get_container_name()
+        assert mock.call_count == 2
+
+
+def test_stop_remove_parallel():
+
+    project = Project('busybox', prefix='down')
+
+    stopped = []
+    removed = []
+    running = {'down_busybox_1': 'Up 1 second', 'down_link_1': 'Up 1 second'}
+
+    def stop(container, **options):
+        assert options == {'timeout': 0}
+        stopped.append(container.name)
+        running[container.name] = 'Exited (0) 1 second ago'
+
+    def remove(container, **options):
+        removed.append(container.name)
+
+    def containers(**kwargs):
+        return [_ps('down', n, n.split('_')[1], status=s)
+                for n, s in sorted(running.items())]
+
+    with patch.object(project.client, 'containers', side_effect=containers), \
+            patch.object(Container, 'stop', autospec=True, side_effect=stop), \
+            patch.object(Container, 'remove', autospec=True,
+                         side_effect=remove), \
+            patch.object(Container, 'is_running', new_callable=PropertyMock,
+                         return_value=False):
+
+        project.stop(service_names=['busybox'], parallel=4, timeout=0)
+        assert stopped == ['down_busybox_1']
+
+        project.stop(service_names=['busybox'], include_deps=True,
+                     parallel=4, timeout=0)
+        # busybox is not running anymore
+        assert stopped[1:] == ['down_link_1']
+
+        project.remove_stopped(parallel=4)
+        assert sorted(removed) == ['down_busybox_1', 'down_link_1']
+
+
+def test_up_link_healthcheck(config_path, data_tree):
+
+    data_path = data_tree({'hcapp': ['hclink'], 'hclink': []})
+    with open(config_path) as fo:
+        settings = yaml.load(fo)
+    settings.update({b'skip_wait': False, b'wait_seconds': 1})
+    with open(config_path, 'w') as fo:
+        yaml.dump(settings, fo, default_flow_style=False)
+    data_path.join('hclink', 'fig.yml').write(
+        'app:\n  image: bag8/hclink\n  healthcheck:\n    command: "true"\n')
+    project = Project('hcapp', prefix='hc')
+
+    # docker daemon stand-in
+    containers = {}
+    listings = []
+
+    def create_container(**options):
+        container_id = options['name']
+        containers[container_id] = {
+            'Id': container_id, 'Name': '/' + container_id,
+            'Names': ['/' + container_id], 'Image': options['image'],
+            'Labels': options['labels'], 'Status': 'Created',
+            'Config': {'Labels': options['labels'], 'Image': 'x',
+                       'Env': [], 'Cmd': None, 'ExposedPorts': {}},
+            'State': {'Running': False}, 'HostConfig': {},
+            'NetworkSettings': {'Ports': {}},
+        }
+        return {'Id': container_id}
+
+    def list_containers(filters=None, **kwargs):
+        listings.append(filters)
+        labels = [l.split('=', 1) for l in filters['label']]
+        return [dict(c) for c in containers.values()
+                if all(c['Labels'].get(k) == v for k, v in labels)]
+
+    def start(container_id, **options):
+        containers[container_id]['Status'] = 'Up 1 second'
+        containers[container_id]['State']['Running'] = True
+
+    def exec_create(container_id, cmd):
+        exec_calls.append(container_id)
+        # fails on containers not running
+        assert containers[container_id]['State']['Running']
+        return {'Id': container_id}
+
+    client = project.client
+    exec_calls = []
+    with patch.object(client, 'containers', side_effect=list_containers), \
+            patch.object(client, 'create_container',
+                         side_effect=create_container), \
+            patch.object(client, 'inspect_container',
+                         side_effect=lambda i: containers[i]), \
+            patch.object(client, 'inspect_image',
+                         return_value={'Id': 'image'}), \
+            patch.object(client, 'start', side_effect=start), \
+            patch.object(client, 'exec_create', side_effect=exec_create), \
+            patch.object(client, 'exec_start'), \
+            patch.object(client, 'exec_inspect',
+                         return_value={'ExitCode': 0}):
+        project.up()
+
+    assert sorted(c['Status'] for c in containers.values()) == [
+        'Up 1 second', 'Up 1 second']
+    # the link started by this up was checked
+    assert exec_calls == ['hc_hclink_1']
@@ -0,0 +1,75 @@
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import threading
+
+from docker.errors import APIError
+from mock import Mock
+from mock import patch
+
+from bag8.push import push_projects
+
+
+def _stream(digest, layers=('l1', 'l2')):
+    for layer in layers:
+        yield json.dumps({'status': 'Pushing', 'id': layer,
+                          'progressDetail': {}})
+        yield json.dumps({'status': 'Image successfully pushed',
+                          'id': layer, 'progressDetail': {}})
+    yield json.dumps({'status': 'latest: digest: {0} size: 1234'.format(
+        digest)})
+
+
+def test_push_projects(data_tree, local_path):
+
+    data_tree({'a': [], 'b': ['a'], 'c': []})
+    cache_path = os.path.join(local_path, 'pushed.json')
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+
+    # local registry stand-in
+    images = {'bag8/a:latest': 'id-a', 'bag8/b:latest': 'id-b'}
+    registry = {}
+    pushing = set()
+    both_pushing = threading.Event()
+
+    def inspect_image(image):
+        if image not in images:
+            raise APIError('', Mock())
+        return {'Id': images[image]}
+
+    def push(repo, tag=None, **kwargs):
+        image = '{0}:{1}'.format(repo, tag)
+        pushing.add(image)
+        if len(pushing) == 2:
+            both_pushing.set()
+        # a and b pushed at the same time
+        if kwargs.get('insecure_registry'):
+            assert both_pushing.wait(5)
+        registry[image] = images[image]
+        return _stream('sha256:' + images[image])
+
+    def run(names, **kwargs):
+        registry.clear()
+        pushing.clear()
+        with patch('docker.Client.inspect_image',
+                   side_effect=inspect_image), \
+                patch('docker.Client.push', side_effect=push):
+            push_projects(names, **kwargs)
+        return sorted(registry)
+
+    # concurrently
+    pushed = run(['a', 'b', 'a'], parallel=2, insecure_registry=True)
+    assert pushed == ['bag8/a:latest', 'bag8/b:latest']
+    with open(cache_path) as fd:
+        assert json.load(fd)['bag8/a:latest'] == {
+            'id': 'id-a', 'digest': 'sha256:id-a'}
+
+    # unchanged
+    assert run(['a', 'b']) == []
+    assert run(['a'], force=True) == ['bag8/a:latest']
+
+    # rebuilt
+    images['bag8/b:latest'] = 'id-b2'
+    assert run(['a', 'b']) == ['bag8/b:latest']
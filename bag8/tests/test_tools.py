@@ -0,0 +1,169 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+
+from time import time
+
+import pytest
+
+from docker.errors import APIError
+from mock import Mock
+from mock import patch
+
+from bag8.exceptions import CheckCallFailed
+from bag8.project import Project
+from bag8.tools import Tools
+
+
+def _project(name, container_name='c_{0}_1'):
+    project = Project(name)
+    project.get_container_name = Mock(
+        return_value=container_name and container_name.format(name))
+    return project
+
+
+def test_render_sites():
+
+    projects = [
+        _project('busybox'),
+        _project('link'),  # no site.conf
+        _project('busybox', container_name=None),  # not running
+    ]
+
+    with patch.object(Project, 'iter_projects', return_value=projects):
+        sites = Tools().render_sites(parallel=4)
+    assert [(n, c) for n, c, _ in sites] == [('busybox', 'c_busybox_1')]
+    assert sites[0][2].splitlines()[1].strip() == 'server link.docker:1234;'
+
+    with patch.object(Project, 'iter_projects', return_value=projects):
+        sites = Tools().render_sites(upstream_server_domain='192.168.0.1',
+                                     local_projects=['link'])
+    assert sites[0][2].splitlines()[1].strip() == 'server link.docker:1234;'
+
+    with patch.object(Project, 'iter_projects', return_value=projects):
+        sites = Tools().render_sites(upstream_server_domain='192.168.0.1',
+                                     local_projects=['busybox'])
+    assert sites[0][2].splitlines()[1].strip() == 'server 192.168.0.1:1234;'
+
+
+def test_nginx_incremental(local_path):
+
+    conf_path = os.path.join(local_path, 'nginx', 'conf.d')
+    sites = [('a', 'c_a_1', 'A'), ('b', 'c_b_1', 'B')]
+
+    # first run creates the container
+    with patch.object(Tools, 'render_sites', return_value=sites), \
+            patch('bag8.tools.inspect', side_effect=APIError('', Mock())), \
+            patch('bag8.tools.stream_call') as stream_call:
+        Tools().nginx(incremental=True)
+    args = stream_call.call_args[0][0]
+    assert args[:2] == ['docker', 'run']
+    assert sorted(os.listdir(conf_path)) == ['a.conf', 'b.conf']
+    label = args[args.index('--label') + 1]
+    container_hash = label.split('=')[1]
+
+    # same links, same sites: nothing to do
+    with patch.object(Tools, 'render_sites', return_value=sites), \
+            patch.object(Tools, '_nginx_hash', return_value=container_hash), \
+            patch('bag8.tools.stream_call') as stream_call:
+        assert Tools().nginx(incremental=True) is None
+    assert not stream_call.called
+
+    # same links, one site changed: reload
+    sites = [('a', 'c_a_1', 'A2'), ('b', 'c_b_1', 'B')]
+    with patch.object(Tools, 'render_sites', return_value=sites), \
+            patch.object(Tools, '_nginx_hash', return_value=container_hash), \
+            patch('bag8.tools.stream_call') as stream_call:
+        Tools().nginx(incremental=True)
+    stream_call.assert_called_once_with(['docker', 'exec', 'nginx',
+                                        'nginx', '-s', 'reload'], exit=True)
+    with open(os.path.join(conf_path, 'a.conf')) as fo:
+        assert fo.read() == 'A2'
+
+    # links changed: recreate
+    sites = [('a', 'c_a_1', 'A2')]
+    with patch.object(Tools, 'render_sites', return_value=sites), \
+            patch.object(Tools, '_nginx_hash', return_value=container_hash), \
+            patch('bag8.tools.inspect'), \
+            patch('bag8.tools.stream_call') as stream_call:
+        Tools().nginx(incremental=True)
+    rm_args = stream_call.call_args_list[0][0][0]
+    assert rm_args == ['docker', 'rm', '-f', 'nginx']
+    assert stream_call.call_args[0][0][:2] == ['docker', 'run']
+    assert os.listdir(conf_path) == ['a.conf']
+
+
+def test_watch_events():
+
+    events = [
+        {'status': 'start', 'id': 'a', 'time': 1},
+        {'status': 'die', 'id': 'gone', 'time': 2},
+        {'status': 'destroy', 'id': 'gone', 'time': 3},
+        {'status': 'create', 'id': 'b', 'time': 4},
+        {'status': 'die', 'id': 'c', 'time': 5},
+        {'status': 'die', 'id': 'unknown', 'time': 6},
+    ]
+    labels = {
+        'a': {'com.docker.compose.project': 'bag8',
+              'com.docker.compose.bag8-service': 'busybox'},
+        'c': {'com.docker.compose.project': 'dev',
+              'com.docker.compose.bag8-service': 'link'},
+    }
+
+    def inspect(container_id):
+        if container_id not in labels:
+            raise APIError('', Mock())
+        return {'Config': {'Labels': labels[container_id]}}
+
+    client = Mock()
+    # removed before its die event is seen, known from the first listing
+    client.containers.return_value = [
+        {'Id': 'gone', 'Labels': {
+            'com.docker.compose.project': 'dev',
+            'com.docker.compose.bag8-service': 'gone'}},
+    ]
+    queue = Mock()
+    # stream closed: stop the loop instead of reconnecting
+    with patch('bag8.tools.get_client', return_value=client), \
+            patch('bag8.tools.inspect', side_effect=inspect), \
+            patch('bag8.tools.sleep', side_effect=KeyboardInterrupt):
+        client.events.side_effect = [iter(events), Exception('closed')]
+        try:
+            Tools()._watch_events(queue)
+        except KeyboardInterrupt:
+            pass
+
+    assert [c[0][0] for c in queue.put.call_args_list] == [
+        ('bag8', 'busybox'), ('dev', 'gone'), ('dev', 'gone'),
+        ('dev', 'link')]
+    # reconnects from the last event seen
+    assert client.events.call_args[1]['since'] == 6
+
+
+def test_watch_debounce():
+
+    # events keep coming: collected until max_debounce
+    events = Mock()
+    events.get.side_effect = lambda timeout: events.get.call_count
+    start = time()
+    changed = Tools()._collect(events, debounce=1, max_debounce=0.2)
+    assert time() - start < 1
+    assert len(changed) > 1
+
+
+def test_watch_nginx_failed_reload():
+
+    sites = [('a', 'c_a_1', 'A')]
+    collected = [set([('bag8', 'a')]), set([('bag8', 'a')]),
+                 KeyboardInterrupt()]
+    with patch.object(Tools, 'render_sites', return_value=sites), \
+            patch.object(Tools, '_render_site', return_value=sites[0]), \
+            patch.object(Tools, '_watch_events'), \
+            patch.object(Tools, '_collect', side_effect=collected), \
+            patch.object(Tools, 'nginx') as nginx:
+        nginx.side_effect = [None, CheckCallFailed('reload failed'), None]
+        with pytest.raises(KeyboardInterrupt):
+            Tools().watch_nginx()
+    # still watching after the failed reload
+    assert nginx.call_count == 3
+    assert nginx.call_args[1]['exit'] is False
@@ -0,0 +1,162 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import socket
+import sys
+import threading
+
+from time import time
+
+import pytest
+
+from bag8.exceptions import CheckCallFailed
+from bag8.exceptions import WaitLinkFailed
+from bag8.utils import parallel_dag
+from bag8.utils import parse_duration
+from bag8.utils import stream_call
+from bag8.utils import write_atomic
+from bag8.utils import wait_all
+
+
+def test_parallel_dag():
+
+    deps = {
+        'a': ['b', 'c'],
+        'b': ['d'],
+        'c': ['d'],
+        'd': [],
+    }
+    done = []
+    started = {'b': threading.Event(), 'c': threading.Event()}
+
+    def func(node):
+        # b and c are independent, they should run at the same time
+        if node in started:
+            started[node].set()
+            assert all(e.wait(5) for e in started.values())
+        assert all(d in done for d in deps[node])
+        done.append(node)
+        return node.upper()
+
+    results = parallel_dag(func, sorted(deps), deps.get, workers=4)
+    assert results == {'a': 'A', 'b': 'B', 'c': 'C', 'd': 'D'}
+    assert done[0] == 'd'
+    assert done[-1] == 'a'
+
+
+def test_parallel_dag_error():
+
+    def func(node):
+        if node == 'b':
+            raise KeyError(node)
+
+    with pytest.raises(KeyError):
+        parallel_dag(func, ['a', 'b'], {'a': ['b'], 'b': []}.get, workers=2)
+
+
+def _listen(port=0):
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', port))
+    server.listen(5)
+    return server
+
+
+def test_wait_all():
+
+    ready = _listen()
+    ready_port = ready.getsockname()[1]
+
+    # not listening yet
+    later = _listen()
+    later_port = later.getsockname()[1]
+    later.close()
+
+    timer = threading.Timer(0.3, lambda: servers.append(_listen(later_port)))
+    servers = [ready]
+    timer.start()
+    try:
+        wait_all([
+            ('127.0.0.1', ready_port),
+            ('127.0.0.1', later_port),
+        ], max_wait=5)
+    finally:
+        timer.join()
+        for server in servers:
+            server.close()
+
+    # never listening
+    with pytest.raises(WaitLinkFailed):
+        wait_all([('127.0.0.1', later_port)], max_wait=0.5)
+
+
+def test_stream_call(capsys):
+
+    script = 'import sys\nfor i in range(100): print(i)\nsys.stderr.write("e")'
+    out, err, code = stream_call([sys.executable, '-c', script], tail=3)
+    assert (out, err, code) == (b'97\n98\n99', b'e', 0)
+    # forwarded as it comes
+    captured = capsys.readouterr()
+    assert captured[0].splitlines()[:2] == ['0', '1']
+    assert captured[1] == 'e\n'
+
+    script = 'import sys\nprint("out")\nsys.exit(3)'
+    with pytest.raises(CheckCallFailed) as e:
+        stream_call([sys.executable, '-c', script], exit=False, echo=False)
+    assert 'exit code 3' in str(e.value)
+    assert 'out' in str(e.value)
+
+    with pytest.raises(SystemExit) as e:
+        stream_call([sys.executable, '-c', script], echo=False)
+    assert e.value.code == 3
+
+
+def test_stream_call_timeout():
+
+    script = 'import time\nprint("started")\ntime.sleep(10)'
+    start = time()
+    with pytest.raises(CheckCallFailed) as e:
+        stream_call([sys.executable, '-u', '-c', script], exit=False,
+                    timeout=0.5)
+    assert time() - start < 5
+    assert 'timeout' in str(e.value)
+    assert 'started' in str(e.value)
+
+    cancel = threading.Event()
+    threading.Timer(0.3, cancel.set).start()
+    with pytest.raises(CheckCallFailed) as e:
+        stream_call([sys.executable, '-c', script], exit=False, cancel=cancel)
+    assert 'cancelled' in str(e.value)
+
+
+def test_parse_duration():
+
+    assert parse_duration('90s') == 90
+    assert parse_duration('12h') == 12 * 3600
+    assert parse_duration(' 7d') == 7 * 24 * 3600
+    with pytest.raises(ValueError):
+        parse_duration('7 days')
+
+
+def test_write_atomic_threads(tmpdir):
+
+    path = str(tmpdir.join('sub', 'file.json'))
+    errors = []
+
+    def write(n):
+        try:
+            for i in range(300):
+                write_atomic(path, '{0}-{1}'.format(n, i))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(os.path.dirname(path)) == ['file.json']
+    with open(path) as fd:
+        assert fd.read().endswith('-299')
@@ -1,8 +1,13 @@
 from __future__ import absolute_import, division, print_function
 
 import os
+import time
+
+from mock import patch
 
 from bag8.project import Project
+from bag8.utils import load_yaml_file
+from bag8.utils import yaml_load
 from bag8.yaml import Yaml
 
 
@@ -160,3 +165,98 @@ def test_service_dicts():
             'links': []
         }
     ])
+
+
+def test_load_yaml_file(tmpdir):
+
+    path = tmpdir.join('fig.yml')
+    path.write('app:\n  links:\n    - link\n')
+
+    # parsed once, returns copies
+    with patch('bag8.utils.yaml_load', wraps=yaml_load) as mock:
+        data = load_yaml_file(str(path))
+        data['app']['links'].append('link.2')
+        assert load_yaml_file(str(path)) == {'app': {'links': ['link']}}
+    assert mock.call_count == 1
+
+    # parsed again on file change
+    path.write('app: {}\n')
+    assert load_yaml_file(str(path)) == {'app': {}}
+
+
+def test_render_linear(data_tree):
+
+    # 10 layers of 20 projects, each linked to 3 projects of the next layer
+    layers = [['p{0}x{1}'.format(l, i) for i in range(20)] for l in range(10)]
+    projects = {'root': layers[0]}
+    for l, layer in enumerate(layers):
+        for i, name in enumerate(layer):
+            next_layer = layers[l + 1] if l + 1 < len(layers) else []
+            projects[name] = [next_layer[(i + j) % len(next_layer)]
+                              for j in range(3) if next_layer]
+    data_tree(projects)
+
+    start = time.time()
+    with patch.object(Yaml, '_get_customized_yml',
+                      side_effect=Yaml._get_customized_yml,
+                      autospec=True) as mock:
+        data = Yaml(Project('root')).data
+    # about ten times the current duration, catches a quadratic merge
+    assert time.time() - start < 3
+
+    # each project merged once
+    assert mock.call_count == 201
+    assert len(data) == 201
+    assert data['p0x0']['environment']['BAG8_LINKS'] == 'p1x0 p1x1 p1x2'
+
+
+def test_data_cache(data_tree):
+
+    data_path = data_tree({
+        'a': ['b'],
+        'b': [],
+    })
+
+    data = Yaml(Project('a')).data
+
+    # loaded from cache
+    with patch.object(Yaml, 'render') as mock:
+        assert Yaml(Project('a')).data == data
+    assert not mock.called
+
+    # not loaded when disabled
+    with patch.object(Yaml, '_load_cache') as mock:
+        assert Yaml(Project('a'), cache=False).data == data
+    assert not mock.called
+
+    # rendered again when a dep changes
+    data_path.join('b', 'fig.yml').write('app:\n  image: bag8/c\n')
+    data = Yaml(Project('a')).data
+    assert data['b']['image'] == 'bag8/c'
+
+    # rendered again in develop mode
+    with patch.object(Yaml, 'render') as mock:
+        Yaml(Project('a', develop=True)).data
+    assert mock.called
+
+    # rendered again after a bag8 upgrade
+    Yaml(Project('a')).data
+    with patch('bag8.yaml.bag8_version', return_value='99.0'), \
+            patch.object(Yaml, 'render') as mock:
+        Yaml(Project('a')).data
+    assert mock.called
+
+
+def test_healthcheck_not_rendered(data_tree):
+
+    data_path = data_tree({'a': ['b'], 'b': []})
+    data_path.join('b', 'fig.yml').write(
+        'app:\n  image: bag8/b\n  healthcheck:\n    log: ready\n')
+
+    for cache in [False, True, True]:
+        _yaml = Yaml(Project('a'), cache=cache)
+        assert 'healthcheck' not in _yaml.data['b']
+        service_dicts = dict((d['name'], d) for d in _yaml.service_dicts)
+        assert service_dicts['b']['healthcheck'] == {'log': 'ready'}
+        assert 'healthcheck' not in service_dicts['a']
+    assert Project('a').get_service('b').healthcheck == {'log': 'ready'}
@@ -1,19 +1,41 @@
 from __future__ import absolute_import, print_function
 
+import hashlib
 import logging
 import os
 import shutil
+import threading
+
+from functools import partial
+from Queue import Empty
+from Queue import Queue
+from time import sleep
+from time import time
 
 from docker.errors import APIError
 
+from compose.const import LABEL_PROJECT
+
+from bag8.client import get_client
 from bag8.config import Config
+from bag8.const import LABEL_BAG8_NGINX
+from bag8.const import LABEL_BAG8_SERVICE
+from bag8.exceptions import CheckCallFailed
 from bag8.project import Project
-from bag8.utils import check_call
+from bag8.project import ProjectRef
 from bag8.utils import inspect
+from bag8.utils import parallel_map
+from bag8.utils import simple_name
+from bag8.utils import stream_call
+from bag8.utils import swap_dir
+from bag8.utils import write_atomic
 
 
 log = logging.getLogger(__name__)
 
+# docker events updating nginx sites
+WATCHED_EVENTS = ['start', 'die', 'destroy']
+
 
 class Tools(object):
 
@@ -22,16 +44,16 @@ class Tools(object):
 
     def dns(self):
 
-        config = Config()
+        config = Config.get()
 
         # not running
         try:
             if not inspect('dnsdock')['State']['Running']:
-                return check_call(['docker', 'start', 'dnsdock'])
+                return stream_call(['docker', 'start', 'dnsdock'])
         # not exist
         except APIError:
             log.info("Starting docker DNS server.")
-            return check_call([
+            return stream_call([
                 'docker',
                 'run',
                 '-d',
@@ -43,16 +65,71 @@ class Tools(object):
                 "-domain={0}".format(config.domain_suffix)
             ])
 
+    def _render_site(self, project, local_projects=None,
+                     upstream_server_domain=None):
+        """Returns (name, container name, conf content) for a running project
+        having a site.conf, None otherwise.
+        """
+        # shortcut
+        name = project.simple_name
+        site_conf_path = project.site_conf_path
+        if not site_conf_path:
+            return None
+        # get container
+        container_name = project.get_container_name()
+        if not container_name:
+            return None
+        # render nginx site conf
+        with open(site_conf_path) as site_available:
+            environment = project.environment
+            upstream_domain = environment.get('NGINX_UPSTREAM_SERVER_DOMAIN')
+            # specified from cli and require overriding ?
+            if upstream_server_domain \
+                    and (not local_projects or name in local_projects):
+                upstream_domain = upstream_server_domain
+            content = site_available.read() % dict(environment, **{
+                'UPSTREAM_SERVER_DOMAIN': upstream_domain
+            })
+        return name, container_name, content
+
+    def render_sites(self, local_projects=None, upstream_server_domain=None,
+                     parallel=8):
+        """Renders the running projects site confs in a pool of workers, sorted
+        by project name.
+        """
+        render = partial(self._render_site, local_projects=local_projects,
+                         upstream_server_domain=upstream_server_domain)
+        sites = parallel_map(render, Project.iter_projects(), workers=parallel)
+        return sorted(s for s in sites if s)
+
+    def _sync_sites(self, sites, conf_path):
+        """Writes changed site confs and removes stale ones in place, returns
+        True if something changed.
+        """
+        changed = False
+        enabled = dict(('{0}.conf'.format(name), content)
+                       for name, _, content in sites)
+        for filename in os.listdir(conf_path):
+            if filename.endswith('.conf') and filename not in enabled:
+                os.remove(os.path.join(conf_path, filename))
+                changed = True
+        for filename, content in enabled.items():
+            site_enabled_path = os.path.join(conf_path, filename)
+            if os.path.exists(site_enabled_path):
+                with open(site_enabled_path, 'rb') as site_enabled:
+                    if site_enabled.read() == content:
+                        continue
+            write_atomic(site_enabled_path, content)
+            changed = True
+        return changed
+
     def nginx(self, local_projects=None, no_ports=False,
-              upstream_server_domain=None):
+              upstream_server_domain=None, parallel=8, incremental=False,
+              sites=None, exit=True):
 
-        config = Config()
+        config = Config.get()
 
         conf_path = os.path.join(config.tmpfolder, 'nginx', 'conf.d')
-        # remove previous configs
-        shutil.rmtree(conf_path, ignore_errors=True)
-        # create new conf folder
-        os.makedirs(conf_path)
 
         log_path = os.path.join(config.tmpfolder, 'nginx', 'log')
         if not os.path.exists(log_path):
@@ -67,16 +144,13 @@ class Tools(object):
         dnsdock_alias = []
         volumes_from = []
 
-        for project in Project.iter_projects():
-            # shortcut
-            name = project.simple_name
-            site_conf_path = project.site_conf_path
-            if not site_conf_path:
-                continue
-            # get container
-            container_name = project.get_container_name()
-            if not container_name:
-                continue
+        if sites is None:
+            sites = self.render_sites(
+                local_projects=local_projects,
+                upstream_server_domain=upstream_server_domain,
+                parallel=parallel)
+
+        for name, container_name, content in sites:
             # update alias
             dnsdock_alias.append('{0}.nginx.{1}'.format(name,
                                                         config.domain_suffix))
@@ -85,21 +159,6 @@ class Tools(object):
             # add link to nginx
             links.append('{0}:{1}.{2}'.format(container_name, name,
                                               config.domain_suffix))
-            # copy nginx site conf
-            with open(site_conf_path) as site_available:
-                site_enabled_path = os.path.join(conf_path,
-                                                 '{0}.conf'.format(name))
-                upstream_domain = project.environment.get('NGINX_UPSTREAM_SERVER_DOMAIN')  # noqa
-                # specified from cli and require overriding ?
-                if upstream_server_domain \
-                        and (not local_projects or name in local_projects):
-                    upstream_domain = upstream_server_domain
-                with open(site_enabled_path, 'wb') as site_enabled:
-                    site_enabled.write(site_available.read() % dict(
-                        project.environment, **{
-                            'UPSTREAM_SERVER_DOMAIN': upstream_domain
-                        }
-                    ))
 
         args = [
             'docker',
@@ -117,7 +176,148 @@ class Tools(object):
         args = sum([['--volumes-from', v] for v in volumes_from], args)
         args = sum([['-v', v] for v in volumes], args)
         args = sum([['--link', l] for l in links], args)
+        # container config, to know if we can only reload it
+        container_hash = hashlib.sha1(repr(args)).hexdigest()
         args += [
+            '--label', '{0}={1}'.format(LABEL_BAG8_NGINX, container_hash),
             'nginx',
         ]
-        return check_call([str(a) for a in args])
+
+        # running with the same links and volumes: only reload changed sites
+        if incremental and os.path.exists(conf_path) \
+                and self._nginx_hash() == container_hash:
+            if not self._sync_sites(sites, conf_path):
+                return None
+            log.info("Reloading nginx.")
+            return stream_call(['docker', 'exec', 'nginx',
+                                'nginx', '-s', 'reload'], exit=exit)
+
+        # stop previous nginx if exist
+        try:
+            inspect('nginx')
+            stream_call(['docker', 'rm', '-f', 'nginx'], exit=False,
+                        echo=False)
+        except APIError:
+            pass
+
+        # write new configs to a staging dir
+        staging_path = '{0}.{1}'.format(conf_path, os.getpid())
+        shutil.rmtree(staging_path, ignore_errors=True)
+        os.makedirs(staging_path)
+        for name, container_name, content in sites:
+            site_enabled_path = os.path.join(staging_path,
+                                             '{0}.conf'.format(name))
+            with open(site_enabled_path, 'wb') as site_enabled:
+                site_enabled.write(content)
+
+        # swap with previous configs
+        swap_dir(staging_path, conf_path)
+
+        # start a new one
+        return stream_call([str(a) for a in args], exit=exit)
+
+    def _nginx_hash(self):
+        try:
+            state = inspect('nginx')
+        except APIError:
+            return None
+        if not state['State']['Running']:
+            return None
+        return (state['Config'].get('Labels') or {}).get(LABEL_BAG8_NGINX)
+
+    def _watch_events(self, queue):
+        """Puts (prefix, bag8 name) of the bag8 containers that start, die or
+        are removed in the queue, reconnects when the events stream ends.
+        """
+        client = get_client()
+        # removed containers can't be inspected, keep their names by id
+        names = {}
+        for container in client.containers(all=True, filters={
+                'label': LABEL_BAG8_SERVICE}):
+            labels = container.get('Labels') or {}
+            names[container['Id']] = (labels.get(LABEL_PROJECT),
+                                      labels[LABEL_BAG8_SERVICE])
+        since = None
+        while True:
+            try:
+                for event in client.events(since=since, decode=True, filters={
+                        'event': WATCHED_EVENTS,
+                        'label': [LABEL_BAG8_SERVICE]}):
+                    since = event.get('time', since)
+                    status = event.get('status')
+                    if status not in WATCHED_EVENTS:
+                        continue
+                    name = self._event_name(event['id'], names)
+                    if status == 'destroy':
+                        names.pop(event['id'], None)
+                    if name:
+                        queue.put(name)
+            except Exception as e:
+                log.warning('events stream closed: %s', e)
+                sleep(1)
+
+    def _event_name(self, container_id, names):
+        if container_id in names:
+            return names[container_id]
+        try:
+            labels = inspect(container_id)['Config']['Labels'] or {}
+        except APIError:
+            return None
+        if LABEL_BAG8_SERVICE not in labels:
+            return None
+        names[container_id] = (labels.get(LABEL_PROJECT),
+                               labels[LABEL_BAG8_SERVICE])
+        return names[container_id]
+
+    def _collect(self, events, debounce=1, max_debounce=10):
+        """Waits for the next events until none comes for debounce seconds,
+        at most max_debounce seconds.
+        """
+        changed = set([events.get(timeout=1)])
+        deadline = time() + max_debounce
+        while time() < deadline:
+            try:
+                changed.add(events.get(
+                    timeout=min(debounce, max(0, deadline - time()))))
+            except Empty:
+                break
+        return changed
+
+    def watch_nginx(self, local_projects=None, upstream_server_domain=None,
+                    debounce=1, max_debounce=10, **options):
+        """Keeps nginx in sync with the bag8 containers, re-renders the sites
+        of the started or stopped projects only, once per burst of events.
+        """
+        render = partial(self._render_site, local_projects=local_projects,
+                         upstream_server_domain=upstream_server_domain)
+        sites = dict((site[0], site) for site in self.render_sites(
+            local_projects=local_projects,
+            upstream_server_domain=upstream_server_domain,
+            parallel=options.get('parallel', 8)))
+        self.nginx(sites=sorted(sites.values()), incremental=True, **options)
+
+        events = Queue()
+        thread = threading.Thread(target=self._watch_events, args=(events,))
+        thread.daemon = True
+        thread.start()
+
+        while True:
+            # wait with timeout keeps ctrl-c working
+            try:
+                changed = self._collect(events, debounce=debounce,
+                                        max_debounce=max_debounce)
+            except Empty:
+                continue
+            for prefix, bag8_name in changed:
+                log.info('Updating %s site.', bag8_name)
+                site = render(ProjectRef(bag8_name, prefix=prefix))
+                if site:
+                    sites[site[0]] = site
+                else:
+                    sites.pop(simple_name(bag8_name), None)
+            # keep watching, the next events retry
+            try:
+                self.nginx(sites=sorted(sites.values()), incremental=True,
+                           exit=False, **options)
+            except CheckCallFailed as e:
+                log.warning('nginx not updated: %s', e)
@@ -1,27 +1,47 @@
 from __future__ import absolute_import, division, print_function
 
 
+import errno
 import os
+import random
 import re
+import select
+import shutil
 import socket
 import sys
+import tempfile
+import threading
 
-from itertools import count
+from collections import deque
 from functools import partial
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen
 from subprocess import PIPE
-from time import sleep
+from time import time
 
 import click
+import yaml
 
 from distutils.spawn import find_executable
 
-from compose.cli.docker_client import docker_client
-
 from bag8.exceptions import CheckCallFailed, WaitLinkFailed
 
 RE_WORD = re.compile('\W')
+RE_DURATION = re.compile(r'^(\d+)([smhdw])$')
+
+# seconds per duration unit
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+# libyaml bindings when available
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
 
+# process wide parsed yaml files, keyed by path
+_yaml_files = {}
+
+
+# longest line kept in memory by stream_call
+MAX_LINE_SIZE = 64 * 1024
 
 call = partial(Popen, stdout=PIPE, stderr=PIPE)
 
@@ -43,20 +63,258 @@ def check_call(args, exit=True, **kwargs):
         raise CheckCallFailed(out + '\n' + err)
 
 
+def stream_call(args, exit=True, timeout=None, cancel=None, tail=50,
+                echo=True, **kwargs):
+    """Like check_call but forwards output line by line as it comes, keeps
+    only the last `tail` lines of each stream for the result and the error
+    report. The process is killed after `timeout` seconds or once the
+    `cancel` event is set.
+    """
+    proc = call(args, **kwargs)
+    deadline = timeout and time() + timeout
+    tails = {proc.stdout: deque(maxlen=tail), proc.stderr: deque(maxlen=tail)}
+    partials = {proc.stdout: b'', proc.stderr: b''}
+    reason = None
+
+    def emit(fd, line):
+        tails[fd].append(line)
+        if echo:
+            click.echo(line, err=fd is proc.stderr)
+
+    opened = [proc.stdout, proc.stderr]
+    while opened:
+        if deadline and time() > deadline:
+            reason = 'timeout after {0}s'.format(timeout)
+        elif cancel is not None and cancel.is_set():
+            reason = 'cancelled'
+        if reason:
+            proc.kill()
+            break
+        readable, _, _ = select.select(opened, [], [], 0.1)
+        for fd in readable:
+            chunk = os.read(fd.fileno(), 4096)
+            if not chunk:
+                opened.remove(fd)
+                if partials[fd]:
+                    emit(fd, partials[fd])
+                continue
+            lines = (partials[fd] + chunk).split(b'\n')
+            partials[fd] = lines.pop()
+            # bound lines without end of line
+            if len(partials[fd]) > MAX_LINE_SIZE:
+                lines.append(partials[fd])
+                partials[fd] = b''
+            for line in lines:
+                emit(fd, line)
+
+    proc.wait()
+    out = b'\n'.join(tails[proc.stdout])
+    err = b'\n'.join(tails[proc.stderr])
+
+    if not proc.returncode and not reason:
+        return out, err, proc.returncode
+
+    reason = reason or 'exit code {0}'.format(proc.returncode)
+    if exit:
+        if not echo:
+            click.echo(out)
+            click.echo(err, err=True)
+        click.echo('{0}: {1}'.format(args[0], reason), err=True)
+        sys.exit(proc.returncode or 1)
+
+    else:
+        raise CheckCallFailed('{0}: {1}\n{2}\n{3}'.format(
+            args[0], reason, out, err))
+
+
 def exec_(args):
     # byebye!
     os.execv(find_executable(args[0]), args)
 
 
 def wait_(host, port, max_retry=10, retry_interval=1):
-    counter = count()
-    while counter.next() < max_retry:
+    return wait_all([(host, port)], max_wait=max_retry * retry_interval)
+
+
+def wait_all(addresses, max_wait=10, timeout=1, backoff=0.1, max_backoff=2):
+    """Waits until all the (host, port) addresses accept connections. Probes
+    them at once with non blocking connects, retries with a jittered
+    exponential backoff until max_wait seconds.
+    """
+    deadline = time() + max_wait
+    # address -> [attempts, next attempt time]
+    pending = dict(((h, int(p)), [0, 0]) for h, p in addresses)
+    # socket -> (address, connect deadline)
+    sockets = {}
+
+    def retry(address):
+        click.echo('wait for {0}:{1}'.format(*address))
+        attempts = pending[address][0]
+        delay = min(max_backoff, backoff * 2 ** attempts)
+        pending[address] = [attempts + 1,
+                            time() + delay * random.uniform(0.5, 1.5)]
+
+    def connect(address):
+        sock = socket.socket()
+        sock.setblocking(0)
         try:
-            return socket.socket().connect((host, int(port)))
+            err = sock.connect_ex(address)
         except socket.error:
-            click.echo('wait for {}:{}'.format(host, port))
-            sleep(retry_interval)
-    raise WaitLinkFailed("can't link to {}:{}".format(host, port))
+            err = errno.EHOSTUNREACH
+        if err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sockets[sock] = address, time() + timeout
+            return
+        sock.close()
+        if err:
+            retry(address)
+        else:
+            del pending[address]
+
+    try:
+        while pending:
+            now = time()
+            if now > deadline:
+                raise WaitLinkFailed("can't link to {0}".format(', '.join(
+                    '{0}:{1}'.format(*a) for a in sorted(pending))))
+            connecting = set(a for a, _ in sockets.values())
+            for address, (_, next_attempt) in list(pending.items()):
+                if address not in connecting and next_attempt <= now:
+                    connect(address)
+            if not pending:
+                break
+            # sleep until a connect ends, times out or a retry is due
+            connecting = set(a for a, _ in sockets.values())
+            wake = min([d for _, d in sockets.values()] +
+                       [n for a, (_, n) in pending.items()
+                        if a not in connecting] +
+                       [deadline])
+            _, writable, _ = select.select([], list(sockets), [],
+                                           max(0, wake - time()))
+            now = time()
+            for sock, (address, connect_deadline) in list(sockets.items()):
+                if sock in writable:
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                elif connect_deadline <= now:
+                    err = errno.ETIMEDOUT
+                else:
+                    continue
+                del sockets[sock]
+                sock.close()
+                if err:
+                    retry(address)
+                else:
+                    del pending[address]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+def yaml_load(stream):
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def yaml_dump(data, **kwargs):
+    return yaml.dump(data, Dumper=SafeDumper, **kwargs)
+
+
+def copy_data(data):
+    """Copies parsed yaml data, cheaper than deepcopy for dicts and lists.
+    """
+    if isinstance(data, dict):
+        return dict((k, copy_data(v)) for k, v in data.items())
+    if isinstance(data, list):
+        return [copy_data(v) for v in data]
+    return data
+
+
+def load_yaml_file(path):
+    """Returns a copy of the yaml file data, parsed once until the file
+    changes.
+    """
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    stat = (st.st_mtime, st.st_size)
+    if key not in _yaml_files or _yaml_files[key][0] != stat:
+        with open(path) as fd:
+            _yaml_files[key] = stat, yaml_load(fd)
+    return copy_data(_yaml_files[key][1])
+
+
+def parallel_map(func, items, workers=1):
+    """Calls func for each item in a bounded thread pool, returns the results
+    in the items order.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        # get with timeout keeps ctrl-c working
+        return pool.map_async(func, items).get(2 ** 31)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def parallel_dag(func, nodes, deps, workers=1):
+    """Calls func for each node as soon as its deps are done, independent
+    nodes run concurrently. Returns the results keyed by node.
+    """
+    nodes = list(nodes)
+    pending = [(n, set(d for d in deps(n) if d in nodes)) for n in nodes]
+    results = {}
+    errors = []
+    running = set()
+    cond = threading.Condition()
+
+    def run(node):
+        try:
+            result = func(node)
+        except Exception as e:
+            result = None
+            errors.append(e)
+        with cond:
+            results[node] = result
+            running.discard(node)
+            cond.notify()
+
+    pool = ThreadPool(max(1, min(workers, len(nodes))))
+    try:
+        with cond:
+            while (pending or running) and not errors:
+                ready = [n for n, d in pending if d.issubset(results)]
+                if not ready and not running:
+                    raise ValueError('unmet deps: {0}'.format(
+                        ', '.join(str(n) for n, _ in pending)))
+                pending = [(n, d) for n, d in pending if n not in ready]
+                for node in ready:
+                    running.add(node)
+                    pool.apply_async(run, (node,))
+                # wait with timeout keeps ctrl-c working
+                cond.wait(1)
+    finally:
+        pool.close()
+        pool.join()
+
+    if errors:
+        raise errors[0]
+    return results
+
+
+class Progress(object):
+    """Echoes one status line per item when its status changes, thread safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._status = {}
+
+    def update(self, name, status):
+        with self._lock:
+            if self._status.get(name) == status:
+                return
+            self._status[name] = status
+            click.echo('{0}: {1}'.format(name, status))
 
 
 def confirm(msg):
@@ -73,7 +331,8 @@ def confirm(msg):
 
 
 def inspect(container, client=None):
-    client = client or docker_client()
+    from bag8.client import get_client  # avoid circular import
+    client = client or get_client()
     return client.inspect_container(container)
 
 
@@ -81,6 +340,41 @@ def simple_name(text):
     return RE_WORD.sub('', text)
 
 
+def write_atomic(path, content):
+    """Writes content to a temp file then renames it, readers never get a
+    partial file. Concurrent writers each get their own temp file.
+    """
+    dir_path = os.path.dirname(path)
+    if dir_path and not os.path.exists(dir_path):
+        try:
+            os.makedirs(dir_path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path or '.',
+                                    prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fo:
+            fo.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def swap_dir(new_path, path):
+    """Replaces path dir with new_path one, then removes the previous one.
+    """
+    old_path = '{0}.{1}.old'.format(path, os.getpid())
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(new_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
 def write_conf(path, content, bak_path=None):
 
     # keep
@@ -104,3 +398,28 @@ def write_conf(path, content, bak_path=None):
     exit_code = process.wait()
     if exit_code != 0:
         raise Exception('Failed to update {0}'.format(path))
+
+
+def normalize_image(image):
+    from compose.service import parse_repository_tag  # keeps utils light
+    repo, tag = parse_repository_tag(image)
+    return '{0}:{1}'.format(repo, tag or 'latest')
+
+
+def parse_duration(text):
+    """Returns the seconds of a duration like `90s`, `12h` or `7d`.
+    """
+    match = RE_DURATION.match(text.strip())
+    if not match:
+        raise ValueError('invalid duration: {0}'.format(text))
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def bag8_version():
+    """Returns the installed bag8 version, None when not installed.
+    """
+    import pkg_resources  # keeps utils light
+    try:
+        return pkg_resources.get_distribution('bag8').version
+    except pkg_resources.DistributionNotFound:
+        return None
@@ -1,22 +1,34 @@
 from __future__ import absolute_import, division, print_function
 
 import click
+import hashlib
 import os
+import re
 import yaml
 
 from bag8.exceptions import NoProjectYaml
+from bag8.utils import bag8_version
+from bag8.utils import load_yaml_file
 from bag8.utils import simple_name
+from bag8.utils import write_atomic
+from bag8.utils import yaml_dump
+from bag8.utils import yaml_load
 
 
 CURR_DIR = os.path.realpath('.')
 
+# format keys used in dev volumes, ex.: %(PWD)s
+RE_FORMAT_KEY = re.compile(r'%\((\w+)\)s')
+
 
 class Yaml(object):
 
-    def __init__(self, project):
+    def __init__(self, project, cache=True):
         self.project = project
+        self.cache = cache
         self._data = None
         self._bag8_names = {}
+        self._healthchecks = {}
 
     def _get_customized_yml(self, project):
         """Prefixes project sections with project name, ex: pg > busyboxpg.
@@ -30,7 +42,7 @@ class Yaml(object):
             click.echo(e.message)
             return custom_yml
 
-        for k, v in yaml.load(open(project.yaml_path)).items():
+        for k, v in load_yaml_file(project.yaml_path).items():
 
             # ensure environment for coming overinding
             if 'environment' not in v:
@@ -65,10 +77,9 @@ class Yaml(object):
 
     def _update_yml_dict(self, yml_dict, project):
 
-        for p in project.deps:
-            yml_dict = self._update_yml_dict(yml_dict, p)
-
-        yml_dict.update(self._get_customized_yml(project))
+        # deps first, each once
+        for p in project.deps + [project]:
+            yml_dict.update(self._get_customized_yml(p))
 
         return yml_dict
 
@@ -123,15 +134,84 @@ class Yaml(object):
             for k in ['dev_command', 'dev_environment', 'dev_volumes']:
                 if k in self._data[key]:
                     del self._data[key][k]
+            # used by bag8 only, compose rejects it
+            if 'healthcheck' in self._data[key]:
+                self._healthchecks[key] = self._data[key].pop('healthcheck')
 
         # add dockerfile info for build
         self._data[app]['dockerfile'] = os.path.join(self.project.bag8_path,
                                                      'Dockerfile')
 
+    @property
+    def cache_path(self):
+        return os.path.join(self.project.config.tmpfolder, 'render',
+                            '{0}{1}.yml'.format(self.project.bag8_name,
+                                                '.develop' if
+                                                self.project.develop else ''))
+
+    def _cache_key(self, projects):
+        """Hashes all the render inputs: fig.yml files of the tree, used config
+        values, environment and bag8 version.
+        """
+        config = self.project.config
+        key = hashlib.sha1(repr([
+            bag8_version(),
+            config.domain_suffix,
+            config.search_paths,
+            self.project.develop,
+        ]))
+        for name, path in projects:
+            with open(path, 'rb') as fd:
+                content = fd.read()
+            key.update(path)
+            key.update(content)
+            # app dev volumes are rendered with cwd and env values
+            if self.project.develop and name == self.project.bag8_name:
+                key.update(CURR_DIR)
+                for k in sorted(set(RE_FORMAT_KEY.findall(content))):
+                    key.update('{0}={1}'.format(k, os.environ.get(k)))
+        return key.hexdigest()
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return False
+        with open(self.cache_path) as fd:
+            cached = yaml_load(fd)
+        try:
+            projects = [[name, path] for name, path in cached['projects']
+                        if self.project.config.get_project_path(name) ==
+                        os.path.dirname(path)]
+            if len(projects) != len(cached['projects']) \
+                    or self._cache_key(projects) != cached['key']:
+                return False
+        except (IOError, KeyError, TypeError, ValueError):
+            return False
+        self._data = cached['data']
+        self._bag8_names = cached['bag8_names']
+        self._healthchecks = cached['healthchecks']
+        return True
+
+    def _dump_cache(self):
+        try:
+            projects = [[p.bag8_name, p.yaml_path]
+                        for p in self.project.deps + [self.project]]
+        except NoProjectYaml:
+            return
+        write_atomic(self.cache_path, yaml_dump({
+            'key': self._cache_key(projects),
+            'projects': projects,
+            'data': self._data,
+            'bag8_names': self._bag8_names,
+            'healthchecks': self._healthchecks,
+        }))
+
     @property
     def data(self):
         if not self._data:
-            self.render()
+            if not self.cache or not self._load_cache():
+                self.render()
+                if self.cache:
+                    self._dump_cache()
         return self._data
 
     @property
@@ -140,6 +220,8 @@ class Yaml(object):
         for k, v in self.data.items():
             v['name'] = k
             v['bag8_name'] = self._bag8_names.get(k)
+            if k in self._healthchecks:
+                v = dict(v, healthcheck=self._healthchecks[k])
             service_dicts.append(v)
         return service_dicts
 
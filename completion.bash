@@ -1,4 +1,48 @@
+# options taking a value, the project argument is the first other word
+_bag8_value_options="-c --command -p --prefix -s --service --parallel --upstream-server-domain"
+
+_bag8_argument() {
+    local i
+    for ((i=2; i < COMP_CWORD; i++)); do
+        [[ " $_bag8_value_options " == *" ${COMP_WORDS[i-1]} "* ]] && continue
+        [[ "${COMP_WORDS[i]}" != -* ]] && echo "${COMP_WORDS[i]}" && return
+    done
+}
+
+_bag8_project() {
+    local project="$(_bag8_argument)"
+    echo "${project:-$(basename "$PWD")}"
+}
+
 _bag8_completion() {
+    local cur="${COMP_WORDS[COMP_CWORD]}"
+    local prev="${COMP_WORDS[COMP_CWORD-1]}"
+    local command="${COMP_WORDS[1]}"
+
+    # services and projects come from bag8 caches
+    if [[ $COMP_CWORD -ge 2 && "$cur" != -* ]]; then
+        case "$prev" in
+            -s|--service)
+                COMPREPLY=( $(compgen -W "$(bag8 complete services \
+                    "$(_bag8_project)" 2>/dev/null)" -- "$cur") )
+                return 0
+                ;;
+            -p|--local-projects)
+                [[ "$command" != nginx ]] && return 0
+                ;;
+            -c|--command|--prefix|--parallel|--upstream-server-domain)
+                return 0
+                ;;
+            *)
+                [[ "$command" =~ ^(dns|nginx|complete)$ ]] && return 0
+                [[ -n "$(_bag8_argument)" ]] && return 0
+                ;;
+        esac
+        COMPREPLY=( $(compgen -W "$(bag8 complete projects 2>/dev/null)" \
+            -- "$cur") )
+        return 0
+    fi
+
     COMPREPLY=( $( COMP_WORDS="${COMP_WORDS[*]}" \
                    COMP_CWORD=$COMP_CWORD \
                    _BAG8_COMPLETE=complete $1 ) )